@@ -0,0 +1,246 @@
+"""Performance log and aggregate queries for the admin view.
+
+Every time a VC advances, one record (timestamp, VC, singer, song, wait
+time, queue length) is appended to a columnar log in ``analytics/``: one
+binary file per column, plus three columns listing the roles sung in each
+record. Strings are interned into ``strings.txt`` and stored as integer ids,
+so a record costs a few dozen bytes and the files can be read straight into
+numpy arrays.
+
+Appends from several server processes are serialized with an ``flock`` on
+``analytics/.lock`` (POSIX only), and a record torn by a crash is cut off
+before the next one is written, so the columns always stay aligned.
+
+Queries work on whole columns at once (masks, ``bincount``) and never build
+a Python object per record, so months of events aggregate in milliseconds.
+"""
+import os
+import threading
+
+import numpy as np
+
+from file_lock import file_lock
+from queue_state import UNASSIGNED
+from role_matching import assigned_people
+
+ANALYTICS_DIR = "analytics"
+
+EVENT_COLUMNS = {
+    "ts": np.float64,
+    "vc": np.int32,
+    "singer": np.int32,
+    "song": np.int32,
+    "wait": np.float32,      # Seconds from joining (or last turn) to singing; NaN if unknown
+    "queue_len": np.int32,
+}
+ROLE_COLUMNS = {
+    "role_event": np.int64,  # Row number of the event in the event columns
+    "role": np.int32,
+    "role_person": np.int32,
+}
+
+
+def performance_record(vc_id, state):
+    """Record for the turn an advance ended, from the state the commit returned"""
+    turn = state.get("last_turn")
+    if not turn or turn["seq"] != state["seq"]:
+        return None  # This commit did not end a turn, e.g. the queue was already empty
+    joined = turn["joined"]
+    started = turn["started"] or joined
+    wait = max(0.0, started - joined) if joined is not None and started is not None else float("nan")
+    roles = [
+        (role, person)
+        for role, people in turn["role_assignments"].items()
+        for person in assigned_people(people, UNASSIGNED)
+    ]
+    return {
+        "ts": turn["ts"],
+        "vc": vc_id,
+        "singer": turn["singer"],
+        "song": turn["song"],
+        "wait": wait,
+        "queue_len": turn["queue_len"],
+        "roles": roles,
+    }
+
+
+class AnalyticsLog:
+    """Append-only columnar log with vectorized aggregate queries"""
+
+    def __init__(self, directory=ANALYTICS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._strings = []
+        self._ids = {}
+        self._strings_size = 0
+
+    def _path(self, column):
+        return os.path.join(self.directory, f"{column}.bin")
+
+    # ----- strings -----
+
+    def _load_strings(self):
+        """Pick up strings added to the dictionary since the last read"""
+        path = os.path.join(self.directory, "strings.txt")
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size == self._strings_size:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._strings_size)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]  # A torn last line is cut off by the next record()
+        for line in complete.decode("utf-8").split("\n")[:-1]:
+            self._ids.setdefault(line, len(self._strings))
+            self._strings.append(line)
+        self._strings_size += len(complete)
+
+    def _intern(self, text, new_lines):
+        text = " ".join(str(text).split())
+        sid = self._ids.get(text)
+        if sid is None:
+            sid = len(self._strings)
+            self._ids[text] = sid
+            self._strings.append(text)
+            new_lines.append(text)
+        return sid
+
+    # ----- writing -----
+
+    def _truncate_torn(self):
+        """Cut off whatever a crash left half-written, so new rows line up again"""
+        strings_path = os.path.join(self.directory, "strings.txt")
+        if os.path.exists(strings_path) and os.path.getsize(strings_path) > self._strings_size:
+            os.truncate(strings_path, self._strings_size)
+        for columns, length in ((EVENT_COLUMNS, self._length()), (ROLE_COLUMNS, self._length(ROLE_COLUMNS))):
+            for column, dtype in columns.items():
+                path = self._path(column)
+                if os.path.exists(path) and os.path.getsize(path) > length * np.dtype(dtype).itemsize:
+                    os.truncate(path, length * np.dtype(dtype).itemsize)
+
+    def record(self, entry):
+        """Append one performance record (see performance_record)"""
+        if entry is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, file_lock(os.path.join(self.directory, ".lock")):
+            # Strings other processes interned since the last read get their ids first
+            self._load_strings()
+            self._truncate_torn()
+            new_lines = []
+            row = {
+                "ts": entry["ts"],
+                "vc": self._intern(entry["vc"], new_lines),
+                "singer": self._intern(entry["singer"], new_lines),
+                "song": self._intern(entry["song"], new_lines),
+                "wait": entry["wait"],
+                "queue_len": entry["queue_len"],
+            }
+            role_rows = [(self._intern(r, new_lines), self._intern(p, new_lines)) for r, p in entry["roles"]]
+            if new_lines:
+                with open(os.path.join(self.directory, "strings.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(line + "\n" for line in new_lines))
+                self._strings_size = os.path.getsize(os.path.join(self.directory, "strings.txt"))
+            event_no = self._length()
+            for column, dtype in EVENT_COLUMNS.items():
+                with open(self._path(column), "ab") as f:
+                    f.write(np.array([row[column]], dtype=dtype).tobytes())
+            if role_rows:
+                values = {
+                    "role_event": [event_no] * len(role_rows),
+                    "role": [r for r, _ in role_rows],
+                    "role_person": [p for _, p in role_rows],
+                }
+                for column, dtype in ROLE_COLUMNS.items():
+                    with open(self._path(column), "ab") as f:
+                        f.write(np.array(values[column], dtype=dtype).tobytes())
+
+    # ----- reading -----
+
+    def _length(self, columns=EVENT_COLUMNS):
+        """Number of complete rows (columns may differ after a crash mid-append)"""
+        lengths = []
+        for column, dtype in columns.items():
+            try:
+                lengths.append(os.path.getsize(self._path(column)) // np.dtype(dtype).itemsize)
+            except OSError:
+                return 0
+        return min(lengths)
+
+    def _read(self, columns, count=None):
+        out = {}
+        for column, dtype in columns.items():
+            path = self._path(column)
+            out[column] = np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.zeros(0, dtype=dtype)
+        count = min(len(a) for a in out.values()) if count is None else count
+        return {column: a[:count] for column, a in out.items()}
+
+    def events(self):
+        """Event columns as numpy arrays"""
+        with self._lock:
+            events = self._read(EVENT_COLUMNS, self._length())
+            # Strings are written before the rows that use them, so read them last
+            self._load_strings()
+            return events
+
+    def _mask(self, events, vc_id=None, since=None):
+        mask = np.ones(len(events["ts"]), dtype=bool)
+        if vc_id is not None:
+            vid = self._ids.get(vc_id)
+            if vid is None:
+                return np.zeros_like(mask)
+            mask &= events["vc"] == vid
+        if since is not None:
+            mask &= events["ts"] >= since
+        return mask
+
+    def _top(self, ids, k, exclude=()):
+        counts = np.bincount(ids, minlength=len(self._strings)) if len(ids) else np.zeros(len(self._strings), dtype=np.int64)
+        for text in exclude:
+            if text in self._ids:
+                counts[self._ids[text]] = 0
+        order = np.argsort(-counts, kind="stable")[:k]
+        return [(self._strings[i], int(counts[i])) for i in order if counts[i] > 0]
+
+    def top_singers(self, k=10, vc_id=None, since=None):
+        events = self.events()
+        return self._top(events["singer"][self._mask(events, vc_id, since)], k)
+
+    def top_songs(self, k=10, vc_id=None, since=None):
+        events = self.events()
+        return self._top(events["song"][self._mask(events, vc_id, since)], k, exclude=("",))
+
+    def top_roles(self, k=10, vc_id=None, since=None):
+        """Most-sung roles, counting every person assigned to a role"""
+        events = self.events()
+        mask = self._mask(events, vc_id, since)
+        roles = self._read(ROLE_COLUMNS)
+        roles_kept = roles["role_event"] < len(mask)
+        keep = roles_kept.copy()
+        keep[roles_kept] = mask[roles["role_event"][roles_kept]]
+        return self._top(roles["role"][keep], k)
+
+    def average_wait(self, vc_id=None, since=None):
+        """Mean wait in seconds over records with a known wait, or None"""
+        events = self.events()
+        waits = events["wait"][self._mask(events, vc_id, since)]
+        waits = waits[~np.isnan(waits)]
+        return float(waits.mean()) if len(waits) else None
+
+    def queue_length_over_time(self, bucket_seconds=3600, vc_id=None, since=None):
+        """(bucket start timestamps, mean queue length) for buckets with events"""
+        events = self.events()
+        mask = self._mask(events, vc_id, since)
+        buckets = (events["ts"][mask] // bucket_seconds).astype(np.int64)
+        if not len(buckets):
+            return np.zeros(0), np.zeros(0)
+        starts, inverse = np.unique(buckets, return_inverse=True)
+        totals = np.bincount(inverse, weights=events["queue_len"][mask])
+        counts = np.bincount(inverse)
+        return starts * bucket_seconds, totals / counts
+
+    def count(self, vc_id=None, since=None):
+        events = self.events()
+        return int(self._mask(events, vc_id, since).sum())
@@ -0,0 +1,202 @@
+"""Headless benchmark of streamlit_app.py with large rooms.
+
+Seeds ``queue_vc1.json`` with N people (plus Calypso entries and role
+assignments), drives the app through ``streamlit.testing.v1.AppTest`` and
+reports p50/p95 rerun latency and peak traced memory for common actions.
+
+    python benchmarks/app_bench.py                    # compare with baselines.json
+    python benchmarks/app_bench.py --save-baseline    # record new baselines
+    python benchmarks/app_bench.py --sizes 10 100 --repeat 10
+
+Exits with status 1 when an action's p50 is slower than its baseline by more
+than --tolerance (a factor, default 1.5).
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(REPO, "benchmarks", "baselines.json")
+APP_FILES = ("catalogs", "components")
+MANAGER = "Bench Manager"
+SONG = "Polyphemus"
+
+
+def make_workdir():
+    """Copy the app into a scratch directory so the repo's data files are untouched"""
+    work = tempfile.mkdtemp(prefix="app_bench_")
+    for name in os.listdir(REPO):
+        path = os.path.join(REPO, name)
+        if name.endswith(".py"):
+            shutil.copy(path, work)
+        elif name in APP_FILES and os.path.isdir(path):
+            shutil.copytree(path, os.path.join(work, name))
+    return work
+
+
+def seed(size):
+    """Write queue_vc1.json for a room with size people"""
+    from catalog import load_catalog
+    from queue_state import save_state, state_from_dict
+
+    people = [f"Singer {i}" for i in range(size)]
+    roles = load_catalog().roles[SONG]
+    state = state_from_dict({
+        "queue": people,
+        "calypso": [f"Away {i}" for i in range(max(1, size // 10))],
+        "pinged": people[::7],
+        "current_manager": MANAGER,
+        "selected_song": SONG,
+        "role_assignments": {role: [people[i % size]] for i, role in enumerate(roles)},
+    })
+    save_state("vc1", state)
+
+
+def open_app(work):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(work, "streamlit_app.py"), default_timeout=600)
+    at.session_state["current_user_vc1"] = MANAGER
+    at.run()
+    at.button_group[0].set_value("🎵 VC 1").run()
+    return at
+
+
+def role_multiselect(at, role):
+    return next(m for m in at.multiselect if m.key and m.key.startswith(f"vc1_role_multi_{role}_"))
+
+
+def actions(at, size):
+    """name -> callable performing one rerun-triggering action"""
+    counter = {"join": 0, "role": 0, "tab": 0}
+
+    def join():
+        counter["join"] += 1
+        at.text_input(key="vc1_name_input_side").set_value(f"Bench {counter['join']}").run()
+
+    def advance():
+        at.button(key="vc1_advance").click().run()
+
+    def ping():
+        if not at.session_state["show_ping"]:
+            at.button(key="vc1_ping").click().run()
+        at.button(key="vc1_Ping_0").click().run()
+
+    def role_edit():
+        counter["role"] += 1
+        multi = role_multiselect(at, "Odysseus")
+        multi.set_value([f"Singer {counter['role'] % size}"]).run()
+
+    def tab_switch():
+        counter["tab"] += 1
+        target = "✨ Customize" if counter["tab"] % 2 else "🎵 VC 1"
+        at.button_group[0].set_value(target).run()
+
+    return {"join": join, "advance": advance, "ping": ping, "role_edit": role_edit, "tab_switch": tab_switch}
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_size(size, repeat):
+    work = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(work)
+    sys.path.insert(0, work)
+    try:
+        import streamlit as st
+        st.cache_resource.clear()  # Stores and logs cached by an earlier size point at its workdir
+        seed(size)
+        at = open_app(work)
+        results = {}
+        for name, action in actions(at, size).items():
+            action()  # Warm-up
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                action()
+                samples.append((time.perf_counter() - start) * 1000)
+            if name == "tab_switch" and at.button_group[0].value != "🎵 VC 1":
+                at.button_group[0].set_value("🎵 VC 1").run()
+            tracemalloc.start()
+            action()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if at.exception:
+                raise RuntimeError(f"{name} at size {size}: {at.exception[0].value}")
+            results[name] = {
+                "p50_ms": round(statistics.median(samples), 2),
+                "p95_ms": round(percentile(samples, 0.95), 2),
+                "peak_mb": round(peak / 2**20, 2),
+            }
+        return results
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(work)
+        for module in ("queue_state", "storage", "catalog", "roster", "song_search", "discord_output", "role_matching", "analytics"):
+            sys.modules.pop(module, None)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(results, baselines, tolerance):
+    regressions = []
+    for size, actions_ in results.items():
+        for name, stats in actions_.items():
+            base = baselines.get(size, {}).get(name)
+            if base and stats["p50_ms"] > base["p50_ms"] * tolerance:
+                regressions.append(f"{name} @ {size} people: p50 {stats['p50_ms']} ms vs baseline {base['p50_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run_size(size, args.repeat)
+        print(f"\n{size} people")
+        for name, stats in results[str(size)].items():
+            print(f"  {name:12s} p50 {stats['p50_ms']:9.1f} ms   p95 {stats['p95_ms']:9.1f} ms   peak {stats['peak_mb']:7.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines.update(results)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        print(f"\nBaselines saved to {BASELINE_FILE}")
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nNo regressions" if baselines else "\nNo baselines yet (run with --save-baseline)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
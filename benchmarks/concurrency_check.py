@@ -0,0 +1,151 @@
+"""Thread and process hammer for SharedStateStore: no operation may be lost.
+
+P processes with T threads each join N unique names to one VC through
+several ``SharedStateStore`` instances sharing one backend. Every tenth
+join a thread also sends a "reorder" based on version 0, which has to be
+rejected, and saves a custom roles map of more than 4 KB, so the journal
+holds records larger than one read block. Reader threads keep reading the
+snapshots ``get`` returns meanwhile, the way renders do.
+
+    python benchmarks/concurrency_check.py                    # both backends
+    python benchmarks/concurrency_check.py --storage sqlite --threads 32 --processes 4
+
+At the end the stored queue must hold all P*T*N names exactly once (stale
+reorders have to be rejected, not clobber joins), the version must equal
+the number of acknowledged commits, and no reader may have seen its
+snapshot change or raise. Exits with status 1 otherwise.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+VC_ID = "vc1"
+BIG_CUSTOM_ROLES = {"Storm": {"roles": [f"Extra role {k:03d}" for k in range(300)], "icons": {}}}
+
+
+def hammer(work, storage_spec, process, threads, joins, stores_count, readers):
+    """One process worth of writers and readers; returns (commits, conflicts, errors)"""
+    os.chdir(work)
+    from queue_state import StateConflict
+    from storage import SharedStateStore, open_backend
+
+    backend = open_backend(storage_spec)
+    stores = [SharedStateStore(backend, sync_interval=0) for _ in range(stores_count)]
+    commits = []
+    conflicts = []
+    errors = []
+    done = threading.Event()
+
+    def writer(t):
+        store = stores[t % stores_count]
+        for i in range(joins):
+            try:
+                store.commit(VC_ID, {"op": "join", "name": f"p{process}-t{t}-{i}"}, base_version=0)
+                commits.append("join")
+                if i % 10 == 0:
+                    try:
+                        store.commit(VC_ID, {"op": "reorder", "queue": list(store.get(VC_ID)["queue"])}, base_version=0)
+                        commits.append("reorder")
+                    except StateConflict:
+                        conflicts.append(t)
+                    store.commit(VC_ID, {"op": "set", "fields": {"custom_roles": BIG_CUSTOM_ROLES}})
+                    commits.append("custom_roles")
+            except Exception as exc:  # Counted as a failure below
+                errors.append(f"writer {process}/{t}: {type(exc).__name__}: {exc}")
+
+    def reader(r):
+        store = stores[r % stores_count]
+        while not done.is_set():
+            try:
+                state = store.get(VC_ID)
+                seq, names = state["seq"], list(state["queue"])
+                time.sleep(0)  # Let writers run, as a render would
+                if state["seq"] != seq or list(state["queue"]) != names:
+                    errors.append(f"reader {process}/{r}: snapshot changed while it was read")
+            except Exception as exc:
+                errors.append(f"reader {process}/{r}: {type(exc).__name__}: {exc}")
+
+    reader_threads = [threading.Thread(target=reader, args=(r,)) for r in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(t,)) for t in range(threads)]
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+    return len(commits), len(conflicts), errors
+
+
+def final_state(work, storage_spec):
+    """Queue and version as stored, loaded in a fresh process"""
+    os.chdir(work)
+    from storage import open_backend
+
+    state = open_backend(storage_spec).load(VC_ID)
+    return list(state["queue"]), state["seq"]
+
+
+def check(storage_spec, processes, threads, joins, stores_count, readers):
+    """Run one backend; returns a list of problems (empty when everything held)"""
+    work = tempfile.mkdtemp(prefix="concurrency_")
+    try:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(hammer, work, storage_spec, p, threads, joins, stores_count, readers)
+                       for p in range(processes)]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+        with ProcessPoolExecutor(1) as pool:
+            queue, seq = pool.submit(final_state, work, storage_spec).result()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    commits = sum(result[0] for result in results)
+    conflicts = sum(result[1] for result in results)
+    problems = [error for result in results for error in result[2]]
+    expected = {f"p{p}-t{t}-{i}" for p in range(processes) for t in range(threads) for i in range(joins)}
+    lost = expected - set(queue)
+    duplicated = len(queue) - len(set(queue))
+    if lost:
+        problems.append(f"lost {len(lost)} join(s), e.g. {sorted(lost)[:3]}")
+    if duplicated:
+        problems.append(f"{duplicated} duplicated name(s)")
+    if seq != commits:
+        problems.append(f"version {seq} after {commits} acknowledged commits")
+    print(f"{storage_spec:8s} {len(queue):6d}/{len(expected)} names   version {seq:6d}"
+          f"   {conflicts} stale reorder(s) rejected   {elapsed:6.2f} s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", action="append", help="json, sqlite or sqlite:<path>; repeatable (default both)")
+    parser.add_argument("--processes", type=int, default=2, help="processes sharing the data directory")
+    parser.add_argument("--threads", type=int, default=8, help="writer threads per process")
+    parser.add_argument("--joins", type=int, default=100, help="joins per writer thread")
+    parser.add_argument("--stores", type=int, default=4, help="SharedStateStore instances per process")
+    parser.add_argument("--readers", type=int, default=4, help="threads per process reading snapshots meanwhile")
+    args = parser.parse_args()
+
+    failed = False
+    for spec in args.storage or ["json", "sqlite"]:
+        problems = check(spec, args.processes, args.threads, args.joins, args.stores, args.readers)
+        for problem in problems[:10]:
+            print(f"  FAIL {problem}")
+        if len(problems) > 10:
+            print(f"  ... {len(problems) - 10} more")
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Cold-start cost of streamlit_app.py: module imports and the first render.
+
+Runs every measurement in a fresh interpreter, like a new container:
+
+* imports – the app's top-level imports, minus ``import streamlit`` alone,
+  since every Streamlit app pays for that. The slowest modules are listed
+  from ``python -X importtime``.
+* first render – ``AppTest`` running the script once in a scratch copy of
+  the app, imports included.
+
+    python benchmarks/import_bench.py                 # check against the budgets
+    python benchmarks/import_bench.py --budget 100 --repeat 9
+
+Exits with status 1 when the median import time is over --budget ms, or the
+first render over --render-budget ms, so CI can keep heavy imports from
+creeping back onto the startup path.
+"""
+import argparse
+import ast
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO, "streamlit_app.py")
+APP_FILES = ("catalogs", "components")
+BASELINE = "import streamlit, streamlit.components.v1"
+
+TIMER = """
+import time
+start = time.perf_counter()
+{imports}
+print((time.perf_counter() - start) * 1000)
+"""
+
+FIRST_RENDER = """
+import os, sys, time
+os.chdir({work!r})
+sys.path.insert(0, {work!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(os.path.join({work!r}, "streamlit_app.py"), default_timeout=120).run()
+print((time.perf_counter() - start) * 1000)
+if at.exception:
+    sys.exit(at.exception[0].value)
+"""
+
+
+def app_imports():
+    """The import statements at the top level of streamlit_app.py"""
+    with open(APP, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def run_python(code, cwd, *flags):
+    result = subprocess.run([sys.executable, *flags, "-c", code], cwd=cwd, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}")
+    return result
+
+
+def timed_imports(imports, cwd):
+    return float(run_python(TIMER.format(imports=imports), cwd).stdout.split()[-1])
+
+
+def import_tree(code, cwd):
+    """(depth, module, cumulative ms) for every module code imports"""
+    stderr = run_python(code, cwd, "-X", "importtime").stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            depth = (len(name) - len(name.lstrip())) // 2
+            rows.append((depth, name.strip(), int(cumulative) / 1000))
+    return rows
+
+
+def slowest_imports(imports, cwd, top):
+    """(module, cumulative ms) of the slowest top-level imports that streamlit does not pull in anyway"""
+    baseline = {name for _, name, _ in import_tree(BASELINE, cwd)}
+    roots = [(name, ms) for depth, name, ms in import_tree(imports, cwd) if depth <= 1 and name not in baseline]
+    return sorted(roots, key=lambda row: -row[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=100.0, help="ms for the app's own imports")
+    parser.add_argument("--render-budget", type=float, default=2500.0, help="ms for a cold first render")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    args = parser.parse_args()
+
+    imports = app_imports()
+    work = tempfile.mkdtemp(prefix="import_bench_")
+    try:
+        for name in os.listdir(REPO):
+            path = os.path.join(REPO, name)
+            if name.endswith(".py"):
+                shutil.copy(path, work)
+            elif name in APP_FILES and os.path.isdir(path):
+                shutil.copytree(path, os.path.join(work, name))
+        run_python(imports, work)  # Write bytecode caches first, as a built image would have them
+        baseline, full, render = [], [], []
+        for _ in range(args.repeat):
+            baseline.append(timed_imports(BASELINE, work))
+            full.append(timed_imports(imports, work))
+            render.append(float(run_python(FIRST_RENDER.format(work=work), work).stdout.split()[-1]))
+        slowest = slowest_imports(imports, work, args.top)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    own = statistics.median(full) - statistics.median(baseline)
+    first_render = statistics.median(render)
+    print(f"\nstreamlit alone   {statistics.median(baseline):8.1f} ms")
+    print(f"app imports       {statistics.median(full):8.1f} ms   own {own:8.1f} ms   budget {args.budget:.0f} ms")
+    print(f"first render      {first_render:8.1f} ms   budget {args.render_budget:.0f} ms")
+    print("\nSlowest imports outside streamlit:")
+    for name, ms in slowest:
+        print(f"  {name:30s} {ms:8.1f} ms")
+
+    failures = []
+    if own > args.budget:
+        failures.append(f"app imports take {own:.1f} ms, budget {args.budget:.0f} ms")
+    if first_render > args.render_budget:
+        failures.append(f"first render takes {first_render:.1f} ms, budget {args.render_budget:.0f} ms")
+    for line in failures:
+        print(f"\nOver budget: {line}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
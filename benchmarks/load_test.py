@@ -0,0 +1,315 @@
+"""Multi-session load test of the shared queue state, without a browser.
+
+Simulates N Streamlit sessions hammering the same VCs through the path the
+app uses on every rerun: ``SharedStateStore.get`` (a version poll of the
+backend) and ``SharedStateStore.commit`` (journal append or SQLite row
+update). Sessions run as threads sharing one
+store, like sessions inside one server process, and optionally across
+several processes, like several app replicas on one data directory.
+
+    python benchmarks/load_test.py                            # 50 sessions, 10 s, threads
+    python benchmarks/load_test.py --sessions 200 --processes 4 --storage sqlite
+    python benchmarks/load_test.py --think 200 --duration 60  # sessions pause 200 ms between actions
+
+Each session is a viewer (mostly polls, sometimes joins, holds, returns or
+pings itself) or a manager (advances, edits roles, pings, and now and then
+saves a custom roles map of more than 4 KB, so the journal holds records
+larger than one read block). Joins use unique names and people are never
+removed, so at the end every acknowledged join must be in the queue or
+Calypso exactly once, and the VC's version must have grown by exactly the
+number of acknowledged writes. Anything else is reported as lost or
+duplicated.
+
+Reports throughput, p50/p95/p99 latency per action, bytes written per
+byte of operation (write amplification, from /proc/self/io where
+available) and role edits rejected as conflicts. Exits with status 1 when
+operations were lost or duplicated.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+SONG = "Polyphemus"
+VIEWER_MIX = {"poll": 80, "join": 8, "hold": 4, "return": 4, "ping": 4}
+MANAGER_MIX = {"poll": 40, "advance": 10, "role_edit": 30, "ping": 10, "join": 10, "custom_roles": 5}
+ACTIONS = ("poll", "join", "hold", "return", "ping", "advance", "role_edit", "custom_roles")
+# A busy role editor: the whole custom roles map is one journal record of more than 4 KB
+BIG_CUSTOM_ROLES = {SONG: {"roles": [f"Extra role {k:03d}" for k in range(300)], "icons": {}}}
+
+
+def bytes_written():
+    """Bytes this process has passed to write() so far, or None off Linux"""
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Session:
+    """One simulated browser session working on one VC"""
+
+    def __init__(self, store, vc_id, label, manager, think, seed):
+        self.store = store
+        self.vc_id = vc_id
+        self.label = label
+        self.manager = manager
+        self.think = think
+        self.rng = random.Random(seed)
+        self.joined = []      # Names whose join was acknowledged
+        self.held = []
+        self.commits = 0
+        self.conflicts = 0
+        self.errors = []
+        self.op_bytes = 0
+        self.latencies = {action: [] for action in ACTIONS}
+
+    def commit(self, op, base_version=None):
+        from queue_state import StateConflict
+
+        try:
+            self.store.commit(self.vc_id, op, base_version)
+        except StateConflict:
+            self.conflicts += 1
+            return False
+        self.commits += 1
+        self.op_bytes += len(json.dumps(op, ensure_ascii=False))
+        return True
+
+    def step(self, roles):
+        mix = MANAGER_MIX if self.manager else VIEWER_MIX
+        action = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        start = time.perf_counter()
+        if action == "poll":
+            state = self.store.get(self.vc_id)
+            len(state["queue"])
+        elif action == "join":
+            name = f"{self.label}-{len(self.joined)}"
+            if self.commit({"op": "join", "name": name}):
+                self.joined.append(name)
+        elif action == "hold" and len(self.held) < len(self.joined):
+            name = self.rng.choice([n for n in self.joined if n not in self.held])
+            if self.commit({"op": "hold", "name": name}):
+                self.held.append(name)
+        elif action == "return" and self.held:
+            name = self.held.pop(self.rng.randrange(len(self.held)))
+            if not self.commit({"op": "return", "name": name}):
+                self.held.append(name)
+        elif action == "ping":
+            state = self.store.get(self.vc_id)
+            queue = list(state["queue"][:5])
+            if queue:
+                name = self.rng.choice(queue)
+                self.commit({"op": "ping", "name": name, "on": name not in state["pinged"]})
+        elif action == "advance":
+            self.commit({"op": "advance"})
+        elif action == "role_edit":
+            # Like the role multiselects: a whole value based on the version on screen
+            version = self.store.version(self.vc_id)
+            state = self.store.get(self.vc_id)
+            queue = list(state["queue"][:20])
+            if queue:
+                assignments = dict(state.get("role_assignments", {}))
+                assignments[self.rng.choice(roles)] = [self.rng.choice(queue)]
+                fields = {"role_assignments": assignments}
+                if state.get("selected_song") != SONG:
+                    fields["selected_song"] = SONG
+                self.commit({"op": "set", "fields": fields}, base_version=version)
+        elif action == "custom_roles":
+            self.commit({"op": "set", "fields": {"custom_roles": BIG_CUSTOM_ROLES}})
+        else:
+            return
+        self.latencies[action].append((time.perf_counter() - start) * 1000)
+
+    def run(self, deadline, roles):
+        while time.monotonic() < deadline:
+            try:
+                self.step(roles)
+            except Exception as exc:  # Keep going: a failing session is a finding, not a crash
+                self.errors.append(f"{type(exc).__name__}: {exc}")
+            if self.think:
+                time.sleep(self.rng.uniform(0, 2 * self.think) / 1000)
+
+
+def run_worker(worker, sessions, storage_spec, vcs, managers, duration, think, sync_interval):
+    """Run sessions as threads sharing one store; returns the raw results"""
+    from catalog import load_catalog
+    from storage import SharedStateStore, open_backend
+
+    store = SharedStateStore(open_backend(storage_spec), sync_interval=sync_interval)
+    roles = list(load_catalog().roles[SONG])
+    crew = []
+    for i, index in enumerate(sessions):
+        vc_id = f"vc{index % vcs + 1}"
+        crew.append(Session(store, vc_id, f"p{worker}s{index}", index < managers * vcs, think, seed=index))
+    written = bytes_written()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=s.run, args=(deadline, roles)) for s in crew]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # Let journal compactions started by the last commits finish
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(timeout=10)
+    written_after = bytes_written()
+    return {
+        "elapsed": elapsed,
+        "bytes_written": None if written is None else written_after - written,
+        "sessions": [
+            {
+                "vc_id": s.vc_id,
+                "joined": s.joined,
+                "held": s.held,
+                "commits": s.commits,
+                "conflicts": s.conflicts,
+                "errors": s.errors,
+                "op_bytes": s.op_bytes,
+                "latencies": s.latencies,
+            }
+            for s in crew
+        ],
+    }
+
+
+def final_states(storage_spec, vc_ids):
+    """Freshly loaded queue, Calypso and version per VC"""
+    from storage import open_backend
+
+    backend = open_backend(storage_spec)
+    out = {}
+    for vc_id in vc_ids:
+        state = backend.load(vc_id)
+        out[vc_id] = {"queue": list(state["queue"]), "calypso": list(state["calypso"]), "seq": state["seq"]}
+    return out
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def check(results, finals):
+    """(lost, duplicated) operations from acknowledged writes vs. final state"""
+    sessions = [s for result in results for s in result["sessions"]]
+    lost = duplicated = 0
+    for vc_id, final in finals.items():
+        mine = [s for s in sessions if s["vc_id"] == vc_id]
+        present = final["queue"] + final["calypso"]
+        seen = set()
+        for name in present:
+            if name in seen:
+                duplicated += 1
+            seen.add(name)
+        expected = {name for s in mine for name in s["joined"]}
+        lost += len(expected - seen)
+        duplicated += len(seen - expected)
+        # Every acknowledged write is one version; versions without one are phantom writes
+        gap = final["seq"] - sum(s["commits"] for s in mine)
+        if gap > 0:
+            duplicated += gap
+        else:
+            lost += -gap
+    return lost, duplicated
+
+
+def report(results, finals, args):
+    sessions = [s for result in results for s in result["sessions"]]
+    elapsed = max(result["elapsed"] for result in results)
+    total = sum(len(s["latencies"][a]) for s in sessions for a in ACTIONS)
+    commits = sum(s["commits"] for s in sessions)
+    print(f"\n{args.sessions} sessions ({args.processes} process(es)), {args.vcs} VC(s), "
+          f"storage={args.storage}, think={args.think} ms, {elapsed:.1f} s")
+    print(f"  throughput   {total / elapsed:9.1f} actions/s   {commits / elapsed:9.1f} writes/s")
+    for action in ACTIONS:
+        samples = [ms for s in sessions for ms in s["latencies"][action]]
+        if samples:
+            print(f"  {action:10s} n {len(samples):7d}   p50 {percentile(samples, 0.5):8.2f} ms"
+                  f"   p95 {percentile(samples, 0.95):8.2f} ms   p99 {percentile(samples, 0.99):8.2f} ms")
+    op_bytes = sum(s["op_bytes"] for s in sessions)
+    written = [result["bytes_written"] for result in results]
+    if op_bytes and None not in written:
+        print(f"  writes       {sum(written) / 2**20:9.1f} MB for {op_bytes / 2**20:.2f} MB of operations"
+              f"   amplification {sum(written) / op_bytes:.1f}x")
+    conflicts = sum(s["conflicts"] for s in sessions)
+    errors = [e for s in sessions for e in s["errors"]]
+    lost, duplicated = check(results, finals)
+    print(f"  conflicts    {conflicts} role edit(s) rejected as stale")
+    print(f"  lost         {lost}")
+    print(f"  duplicated   {duplicated}")
+    if errors:
+        print(f"  errors       {len(errors)}, first: {errors[0]}")
+    return lost, duplicated, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50, help="simulated sessions in total")
+    parser.add_argument("--processes", type=int, default=1, help="server processes sharing the data directory")
+    parser.add_argument("--vcs", type=int, default=1, help="VCs the sessions are spread over")
+    parser.add_argument("--managers", type=int, default=2, help="manager sessions per VC")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a session's actions, ms")
+    parser.add_argument("--storage", default="json", help="json, sqlite or sqlite:<path>")
+    parser.add_argument("--sync-interval", type=float, default=1.0, help="SharedStateStore poll interval, s")
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="load_test_")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        shutil.copytree(os.path.join(REPO, "catalogs"), os.path.join(work, "catalogs"))
+        slices = [list(range(args.sessions))[p::args.processes] for p in range(args.processes)]
+        params = (args.storage, args.vcs, args.managers, args.duration, args.think, args.sync_interval)
+        if args.processes == 1:
+            results = [run_worker(0, slices[0], *params)]
+        else:
+            with ProcessPoolExecutor(args.processes) as pool:
+                futures = [pool.submit(run_worker, p, slices[p], *params) for p in range(args.processes)]
+                results = [future.result() for future in futures]
+        vc_ids = sorted({s["vc_id"] for result in results for s in result["sessions"]})
+        # A fresh process, so no in-memory cache can hide what actually reached storage
+        with ProcessPoolExecutor(1) as pool:
+            finals = pool.submit(final_states, args.storage, vc_ids).result()
+        lost, duplicated, errors = report(results, finals, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        sessions = [s for result in results for s in result["sessions"]]
+        summary = {
+            "args": vars(args),
+            "lost": lost,
+            "duplicated": duplicated,
+            "errors": len(errors),
+            "latency_ms": {
+                action: {q: round(percentile(samples, p), 3) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+                for action in ACTIONS
+                if (samples := [ms for s in sessions for ms in s["latencies"][action]])
+            },
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if lost or duplicated else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Replay a recorded trace (see recorder.py) against the queue logic.
+
+Every VC starts from the state captured in the trace. Each recorded session
+becomes a thread that repeats its reruns and actions through
+``SharedStateStore`` in a scratch directory, at the recorded pace or faster:
+
+    python benchmarks/replay.py traces/trace-20260101-200000.jsonl              # real time
+    python benchmarks/replay.py traces/trace-....jsonl --speed 10
+    python benchmarks/replay.py traces/trace-....jsonl --speed max --storage sqlite
+
+A rerun loads the state and renders the Discord block (``--no-render``
+skips that). An action is committed against the version its session had
+seen, so stale edits conflict again like they did live. Reports p50/p95/p99
+latency per action, how late events started against the schedule, and total
+wall and CPU time, so storage or rendering changes can be compared on real
+traffic.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def seed(backend, vc_id, data):
+    """Store a recorded state as the VC's starting point"""
+    from queue_state import save_state, state_from_dict
+
+    state = state_from_dict(data)
+    if hasattr(backend, "put"):
+        backend.put(vc_id, state)
+    else:
+        save_state(vc_id, state)
+
+
+def replay(events, speed, storage_spec, render):
+    """Run the trace; returns (latencies per action, lag samples, conflicts, errors, wall s, cpu s)"""
+    import discord_output
+    from queue_state import StateConflict
+    from storage import SharedStateStore, open_backend
+
+    backend = open_backend(storage_spec)
+    for event in events:
+        if event["kind"] == "state":
+            seed(backend, event["vc"], event["state"])
+    store = SharedStateStore(backend, sync_interval=0)  # Reruns always see the latest version, like one server
+
+    by_session = defaultdict(list)
+    for event in events:
+        if event["kind"] != "state":
+            by_session[event["session"]].append(event)
+
+    latencies = defaultdict(list)
+    lags = []
+    conflicts = []
+    errors = []
+    results_lock = threading.Lock()
+
+    def run_session(session_events, begin):
+        for event in session_events:
+            if speed is not None:
+                due = begin + event["t"] / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            started = time.perf_counter()
+            vc_id = event["vc"]
+            try:
+                if event["kind"] == "render":
+                    state = store.get(vc_id)
+                    if render:
+                        discord_output.render({}, state)
+                    action = "render"
+                else:
+                    action = event["op"]["op"]
+                    base = max(0, store.version(vc_id) - event.get("behind", 0))
+                    try:
+                        store.commit(vc_id, dict(event["op"]), base_version=base)
+                    except StateConflict:
+                        with results_lock:
+                            conflicts.append(action)
+            except Exception as exc:  # Report and keep replaying the rest of the trace
+                with results_lock:
+                    errors.append(f"{type(exc).__name__}: {exc}")
+                continue
+            finished = time.perf_counter()
+            with results_lock:
+                latencies[action].append((finished - started) * 1000)
+                if speed is not None:
+                    lags.append((started - (begin + event["t"] / speed)) * 1000)
+
+    cpu = time.process_time()
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=run_session, args=(session_events, begin)) for session_events in by_session.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - begin
+    return latencies, lags, conflicts, errors, wall, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="trace file written by recorder.py")
+    parser.add_argument("--speed", default="1", help="1 for real time, 10 for ten times faster, max for no pauses")
+    parser.add_argument("--storage", default="json", help="json, sqlite or sqlite:<path>")
+    parser.add_argument("--no-render", action="store_true", help="skip rendering the Discord block on reruns")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    import recorder
+
+    speed = None if args.speed == "max" else float(args.speed)
+    header, events = recorder.load(os.path.abspath(args.trace))
+    if not events:
+        print(f"{args.trace} has no events")
+        return 1
+    work = tempfile.mkdtemp(prefix="replay_")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        latencies, lags, conflicts, errors, wall, cpu = replay(events, speed, args.storage, not args.no_render)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    recorded = max(event["t"] for event in events)
+    count = sum(len(samples) for samples in latencies.values())
+    sessions = len({event["session"] for event in events if "session" in event})
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(header["started"])) if "started" in header else "unknown date"
+    print(f"\n{count} events from {sessions} sessions, recorded {when} over {recorded:.1f} s, speed {args.speed}, storage={args.storage}")
+    print(f"  wall {wall:8.2f} s   cpu {cpu:8.2f} s   {count / wall:9.1f} events/s   {cpu / count * 1000:.3f} ms cpu/event")
+    for action, samples in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        print(f"  {action:8s} n {len(samples):7d}   p50 {percentile(samples, 0.5):8.2f} ms"
+              f"   p95 {percentile(samples, 0.95):8.2f} ms   p99 {percentile(samples, 0.99):8.2f} ms")
+    if lags:
+        print(f"  lag      p50 {percentile(lags, 0.5):8.2f} ms   p95 {percentile(lags, 0.95):8.2f} ms   max {max(lags):8.2f} ms behind schedule")
+    print(f"  conflicts {len(conflicts)}")
+    if errors:
+        print(f"  errors    {len(errors)}, first: {errors[0]}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "trace": args.trace,
+                "speed": args.speed,
+                "storage": args.storage,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3),
+                "conflicts": len(conflicts),
+                "errors": len(errors),
+                "latency_ms": {
+                    action: {"n": len(samples), "p50": round(percentile(samples, 0.5), 3),
+                             "p95": round(percentile(samples, 0.95), 3), "p99": round(percentile(samples, 0.99), 3)}
+                    for action, samples in latencies.items()
+                },
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
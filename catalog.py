@@ -0,0 +1,90 @@
+"""Song catalogs (musicals) loaded from ``catalogs/<id>.json``.
+
+A catalog file lists its songs with their YouTube video id and roles, plus
+the icon of every known role. A catalog is parsed into lookup tables once
+and can then be shared by every session in the process; other musicals can
+be added by dropping another file next to ``epic.json`` and pointing
+``SONG_CATALOG`` at it.
+
+Songs or roles renamed in a file are listed under ``renamed`` so queues
+saved with the old names can be brought up to date (see ``rename_op``).
+"""
+import json
+import os
+
+from song_search import SongIndex
+
+CATALOGS_DIR = "catalogs"
+DEFAULT_CATALOG = "epic"
+
+
+class Catalog:
+    """Songs, roles and role icons of one musical"""
+
+    def __init__(self, catalog_id, data):
+        self.id = catalog_id
+        self.name = data.get("name", catalog_id)
+        self.default_icon = data.get("default_icon", "🎶")
+        self.roles = {song["title"]: tuple(song.get("roles", ())) for song in data["songs"]}
+        self.youtube_ids = {song["title"]: song["youtube_id"] for song in data["songs"] if song.get("youtube_id")}
+        self.karaoke_songs = [
+            {"title": title, "url": f"https://www.youtube.com/watch?v={vid}"}
+            for title, vid in self.youtube_ids.items()
+        ]
+        self.role_icons = dict(data.get("role_icons", {}))
+        self._icon_rules = [(rule["icon"], tuple(rule["keywords"])) for rule in data.get("icon_rules", ())]
+        renamed = data.get("renamed", {})
+        self.renamed_songs = dict(renamed.get("songs", {}))
+        self.renamed_roles = dict(renamed.get("roles", {}))
+        self._index = None
+        self._classified = {}  # Role -> icon for roles missing from the file
+        self._renames_checked = {}  # vc_id -> state version already checked for old names
+
+    @property
+    def index(self):
+        """Search index over the catalog's karaoke tracks"""
+        if self._index is None:
+            self._index = SongIndex(self.karaoke_songs)
+        return self._index
+
+    def icon(self, role):
+        """Icon for a role; roles missing from the file are classified once"""
+        icon = self.role_icons.get(role)
+        if icon is None:
+            icon = self._classified.get(role)
+            if icon is None:
+                icon = self._classified[role] = self._classify(role)
+        return icon
+
+    def _classify(self, role):
+        r = role.lower()
+        for icon, keywords in self._icon_rules:
+            if any(k in r for k in keywords):
+                return icon
+        return self.default_icon
+
+    def rename_op(self, vc_id, state):
+        """A "rename" queue operation if state still uses old song/role names, else None"""
+        if not (self.renamed_songs or self.renamed_roles) or self._renames_checked.get(vc_id) == state["seq"]:
+            return None
+        self._renames_checked[vc_id] = state["seq"]
+        songs, roles = self.renamed_songs, self.renamed_roles
+        custom_roles = state.get("custom_roles", {})
+        saved_roles = set(state.get("role_assignments", {}))
+        for custom in custom_roles.values():
+            saved_roles.update(custom.get("roles", ()), custom.get("icons", {}))
+        for counts in state.get("role_counts", {}).values():
+            saved_roles.update(counts)
+        if state.get("selected_song") in songs or not songs.keys().isdisjoint(custom_roles) or not saved_roles.isdisjoint(roles):
+            return {"op": "rename", "songs": songs, "roles": roles}
+        return None
+
+
+def catalog_path(catalog_id):
+    return os.path.join(CATALOGS_DIR, f"{os.path.basename(catalog_id)}.json")
+
+
+def load_catalog(catalog_id=DEFAULT_CATALOG):
+    """Read a catalog file by id"""
+    with open(catalog_path(catalog_id), "r", encoding="utf-8") as f:
+        return Catalog(catalog_id, json.load(f))
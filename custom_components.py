@@ -0,0 +1,38 @@
+"""Custom Streamlit components with their own frontends in components/.
+
+Each frontend is a static ``index.html`` that speaks Streamlit's component
+protocol over ``postMessage`` directly, so there is no JavaScript build
+step. A component rendered with the same key stays mounted across reruns;
+new arguments reach the existing iframe as a small render message instead
+of a new iframe and a new copy of the script.
+"""
+import os
+
+import streamlit.components.v1 as components
+
+COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+
+_reaction_overlay = components.declare_component("reaction_overlay", path=os.path.join(COMPONENTS_DIR, "reactions"))
+
+
+def reaction_overlay(event=None, key=None):
+    """Fireworks overlay for the whole page; event {"id", "word", "colors"} starts a burst.
+
+    Pass the event only in the run where the reaction happened. The overlay
+    plays each id once, so a remount with no event stays quiet.
+    """
+    _reaction_overlay(event=event, key=key, default=None)
+
+
+_youtube_player = components.declare_component("youtube_player", path=os.path.join(COMPONENTS_DIR, "youtube"))
+
+
+def youtube_player(video_id=None, height=800, key=None):
+    """Karaoke player that switches videos in place; no video_id hides it.
+
+    Returns the last state the player reported, {"video_id", "state",
+    "elapsed", "duration"} with state "playing", "paused" or "ended", or
+    None before the first report. Reports only happen on those transitions,
+    so a playing song does not cause reruns.
+    """
+    return _youtube_player(video_id=video_id, height=height, key=key, default=None)
@@ -0,0 +1,206 @@
+"""Compiled templates for the Discord text block.
+
+A template's layout is a block of text with ``{placeholder}`` fields. Fields
+that come from the template itself (texts and symbols) are resolved once when
+the template is compiled; what is left is a flat render plan of literal chunks
+and state slots, so rendering a queue is a single join.
+
+State placeholders:
+
+``{title}`` ``{template_name}`` ``{manager}`` ``{song}``
+``{current}`` ``{next}`` ``{queue}`` ``{calypso}`` ``{roles}``
+
+A layout line starting with ``?`` is left out when all state placeholders on
+it render empty (used for the optional song line).
+
+``render_cached`` keeps the last block per VC, keyed by state version and
+template, so reruns where nothing changed reuse it.
+"""
+import functools
+import html
+import string
+
+from queue_state import UNASSIGNED
+from role_matching import assigned_people
+
+SEPARATOR = "-# ------------------"
+
+DEFAULT_LAYOUT = f"""{{title}}
+{{url}}
+Template by: {{template_name}}
+Managed by: {{manager}}
+?🎵 {{song}}
+{SEPARATOR}
+{{currently_singing}}
+{{current_symbol}} {{current}}
+{SEPARATOR}
+{{next_up}}
+{{next_symbol}} {{next}}
+{SEPARATOR}
+{{on_queue}}
+{{queue}}
+{SEPARATOR}
+{{away_calypso}}
+{{calypso}}
+{SEPARATOR}
+React to join the legend:
+{{reactions}}
+{SEPARATOR}
+{{wheel_link}}
+"""
+
+STATE_FIELDS = ("template_name", "manager", "song", "current", "next", "queue", "calypso", "roles")
+
+class RenderPlan:
+    """A compiled template: literal chunks interleaved with state slots"""
+
+    def __init__(self, lines, queue_symbol, calypso_symbol):
+        # lines is a list of (optional, [chunk, ...]) where a chunk is either a
+        # literal string or a (slot_name,) tuple. Neighbouring literals of
+        # regular lines are merged so rendering touches as few chunks as possible.
+        self.queue_symbol = queue_symbol
+        self.calypso_symbol = calypso_symbol
+        self.slots = {c[0] for _, chunks in lines for c in chunks if isinstance(c, tuple)}
+        self.segments = []  # str literal, slot name, or list of chunks for optional lines
+        for optional, chunks in lines:
+            if optional:
+                self.segments.append(list(chunks))
+                continue
+            for chunk in chunks:
+                if isinstance(chunk, tuple):
+                    self.segments.append(chunk[0])
+                elif self.segments and type(self.segments[-1]) is _Literal:
+                    self.segments[-1] = _Literal(self.segments[-1] + chunk)
+                else:
+                    self.segments.append(_Literal(chunk))
+
+    def render(self, values):
+        """Join the plan with the given slot values"""
+        out = []
+        for seg in self.segments:
+            if type(seg) is _Literal:
+                out.append(seg)
+            elif isinstance(seg, str):
+                out.append(values[seg])
+            elif any(values[c[0]] for c in seg if isinstance(c, tuple)):
+                out.append("".join(values[c[0]] if isinstance(c, tuple) else c for c in seg))
+        return "".join(out)
+
+
+class _Literal(str):
+    """Marks literal text in a render plan, as opposed to a slot name"""
+
+
+def _compile_line(line, template_values):
+    chunks = []
+    try:
+        parsed = list(string.Formatter().parse(line))
+    except ValueError:
+        return [line]  # Unbalanced braces: keep the line as plain text
+    for literal, field, _, _ in parsed:
+        if literal:
+            chunks.append(literal)
+        if field is None:
+            continue
+        if field in STATE_FIELDS:
+            chunks.append((field,))
+        elif field == "title":
+            chunks.append(html.escape(template_values.get("title", "")))
+        else:
+            chunks.append(template_values.get(field, ""))
+    return chunks
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(items):
+    template_values = dict(items)
+    layout = template_values.get("layout") or DEFAULT_LAYOUT
+    lines = []
+    for line in layout.splitlines(keepends=True):
+        optional = line.startswith("?")
+        lines.append((optional, _compile_line(line[1:] if optional else line, template_values)))
+    return RenderPlan(lines, template_values.get("queue_symbol", ""), template_values.get("calypso_symbol", ""))
+
+
+def _template_key(template):
+    return tuple(sorted((k, v) for k, v in template.items() if isinstance(v, str)))
+
+
+def compile_template(template):
+    """Render plan for a template dict, compiled once per distinct template"""
+    return _compile(_template_key(template))
+
+
+def person_roles(role_assignments):
+    """Map each assigned person to the roles they hold"""
+    person_to_roles = {}
+    for role, people in role_assignments.items():
+        for person in assigned_people(people, UNASSIGNED):
+            person_to_roles.setdefault(person, []).append(role)
+    return person_to_roles
+
+
+def state_values(plan, vc_data, template_name=None):
+    """Slot values for a VC state; only the slots the plan uses are built"""
+    queue = vc_data["queue"]
+    pinged = vc_data["pinged"]
+    role_assignments = vc_data.get("role_assignments", {})
+    person_to_roles = person_roles(role_assignments)
+
+    def fmt_name_plain(name):
+        ping = " 📣" if name in pinged else ""
+        roles_for = person_to_roles.get(name, [])
+        role_tag = " [" + ", ".join(roles_for) + "]" if roles_for else ""
+        return f"{name}{ping}{role_tag}"
+
+    builders = {
+        "template_name": lambda: html.escape(template_name if template_name is not None else vc_data["current_template"]),
+        "manager": lambda: html.escape(vc_data["current_manager"] or "-"),
+        "song": lambda: html.escape(vc_data.get("selected_song", "")),
+        "current": lambda: fmt_name_plain(queue[0]) if queue else "-",
+        "next": lambda: fmt_name_plain(queue[1]) if len(queue) >= 2 else "-",
+        "queue": lambda: "\n".join(f"{plan.queue_symbol} {fmt_name_plain(p)}" for p in queue[2:]) or "- None",
+        "calypso": lambda: "\n".join(f"{plan.calypso_symbol} {fmt_name_plain(p)}" for p in vc_data["calypso"]) or "- None",
+        "roles": lambda: "\n".join(
+            f"{role}: {', '.join(assigned_people(people, UNASSIGNED))}"
+            for role, people in role_assignments.items()
+            if assigned_people(people, UNASSIGNED)
+        ),
+    }
+    return {slot: builders[slot]() for slot in plan.slots}
+
+
+def render(template, vc_data, template_name=None):
+    """Discord text block for a VC state"""
+    plan = compile_template(template)
+    return plan.render(state_values(plan, vc_data, template_name))
+
+
+_outputs = {}  # vc_id -> ((state version, template key), text)
+
+
+def render_cached(vc_id, template, vc_data):
+    """Discord text block for a VC, rendered once per state version and template"""
+    key = (vc_data["seq"], _template_key(template))
+    cached = _outputs.get(vc_id)
+    if cached is None or cached[0] != key:
+        cached = (key, render(template, vc_data))
+        _outputs[vc_id] = cached
+    return cached[1]
+
+
+# Placeholder state used by the Customize preview
+SAMPLE_STATE = {
+    "queue": ["[Person 1]", "[Person 2]", "[Person 3]"],
+    "calypso": ["[Person 4]"],
+    "pinged": set(),
+    "current_manager": "[Manager Name]",
+    "current_template": "",
+    "selected_song": "",
+    "role_assignments": {},
+}
+
+
+def render_preview(template, template_name):
+    """Discord text block for a template filled with placeholder people"""
+    return render(template, SAMPLE_STATE, template_name)
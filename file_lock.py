@@ -0,0 +1,26 @@
+"""Exclusive lock between processes sharing the data directory.
+
+``with file_lock(path):`` holds an ``flock`` on ``path`` (created if
+missing) for the block. On Windows there is no ``fcntl`` and the block runs
+without an inter-process lock.
+"""
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process lock
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive flock on path while the block runs (not re-entrant)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,135 @@
+"""Lightweight timing of hot paths.
+
+Wrap a block in ``with section("name"):`` or a function in ``@timed("name")``.
+While profiling is off (the default) both cost one flag check; while it is
+on, every call keeps its duration in a rolling window per section and a
+complete event in a bounded trace buffer.
+
+``stats()`` summarizes the rolling windows for the admin panel and
+``export_trace()`` returns the buffer in Chrome trace-event JSON, which
+chrome://tracing, Perfetto or speedscope render as a flame graph.
+
+Set ``QUEUE_PROFILING=1`` to start with profiling on.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+WINDOW = 200          # Durations kept per section
+TRACE_EVENTS = 20000  # Complete events kept for export
+
+_enabled = os.environ.get("QUEUE_PROFILING", "") not in ("", "0")
+_durations = {}
+_trace = deque(maxlen=TRACE_EVENTS)
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+class _NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSection()
+
+
+class _Section:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+def _record(name, start, end):
+    with _lock:
+        window = _durations.get(name)
+        if window is None:
+            window = _durations[name] = deque(maxlen=WINDOW)
+        window.append(end - start)
+        _trace.append((name, start, end - start, threading.get_ident()))
+
+
+def section(name):
+    """Context manager timing the enclosed block as name"""
+    return _Section(name) if _enabled else _NULL
+
+
+def timed(name=None):
+    """Decorator timing every call of a function"""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(label, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
+
+
+def stats():
+    """Per-section summary of the rolling windows, slowest total first"""
+    with _lock:
+        windows = {name: sorted(d) for name, d in _durations.items() if d}
+    rows = []
+    for name, durations in windows.items():
+        count = len(durations)
+        rows.append({
+            "section": name,
+            "calls": count,
+            "p50_ms": durations[count // 2] / 1e6,
+            "p95_ms": durations[min(count - 1, int(count * 0.95))] / 1e6,
+            "max_ms": durations[-1] / 1e6,
+            "total_ms": sum(durations) / 1e6,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+
+def export_trace():
+    """Buffered events as Chrome trace-event JSON"""
+    with _lock:
+        events = list(_trace)
+    return json.dumps({
+        "traceEvents": [
+            {"name": name, "ph": "X", "ts": start / 1000, "dur": dur / 1000, "pid": _pid, "tid": tid}
+            for name, start, dur, tid in events
+        ],
+        "displayTimeUnit": "ms",
+    })
+
+
+def reset():
+    with _lock:
+        _durations.clear()
+        _trace.clear()
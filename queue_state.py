@@ -0,0 +1,611 @@
+"""Queue state persistence for the EPIC karaoke manager.
+
+Every VC is stored as a snapshot (``queue_{vc_id}.json``) plus an append-only
+operation journal (``queue_{vc_id}.oplog``). Each queue action is written as
+one small JSON line instead of rewriting the whole state document, and the
+journal is folded back into the snapshot by a background compaction once it
+grows past ``COMPACT_EVERY`` records.
+
+``load_state`` replays the journal on top of the snapshot, so a crash at any
+point leaves a recoverable state: the snapshot is replaced atomically and any
+journal records it already contains are skipped by sequence number.
+
+Change detection only looks at ``os.stat`` metadata of the two files. The
+parsed state and the latest sequence number are cached per process, keyed by
+that fingerprint, so a rerun where nothing changed never opens either file.
+
+Several server processes may share the files: allocating a sequence number,
+appending to the journal and compaction all happen under an exclusive
+``flock`` on ``queue_{vc_id}.lock`` (POSIX only; elsewhere the lock only
+covers the threads of one process).
+
+Writes are optimistic: an operation may carry the version it was based on.
+Intent-style operations (join, hold, ping, ...) are simply re-applied to the
+fresh state, while operations that carry whole values computed from what the
+user saw ("set", "reorder") raise ``StateConflict`` if any field they touch
+changed after that version.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from file_lock import file_lock
+from profiling import timed
+from role_matching import record_roles_sung
+from roster import Roster, name_key
+
+UNASSIGNED = "— Unassigned —"
+COMPACT_EVERY = 200  # Journal records before the snapshot gets rewritten
+TAIL_BLOCK = 4096    # Bytes read at a time when looking for the last journal record
+ROLE_UNDO_LIMIT = int(os.environ.get("ROLE_UNDO_LIMIT", "50"))  # Role/song changes kept for undo per VC
+
+# Fields a "set" operation is allowed to overwrite
+SETTABLE_FIELDS = (
+    "current_manager",
+    "current_template",
+    "selected_song",
+    "role_assignments",
+    "custom_roles",
+    "custom_reactions",
+)
+
+# Operations that still make sense when replayed on newer state
+REBASE_SAFE_OPS = {"join", "leave", "hold", "return", "move", "ping", "advance", "clear", "undo", "redo", "rename"}
+
+# Fields touched by each operation kind ("set" touches its own field names)
+OP_FIELDS = {
+    "join": ("queue",),
+    "leave": ("queue", "pinged"),
+    "hold": ("queue", "calypso"),
+    "return": ("queue", "calypso"),
+    "move": ("queue",),
+    "ping": ("pinged",),
+    "advance": ("queue", "selected_song", "role_assignments", "role_counts", "turn_started", "last_turn"),
+    "undo": ("selected_song", "role_assignments"),
+    "redo": ("selected_song", "role_assignments"),
+    "clear": ("queue", "calypso", "pinged"),
+    "reorder": ("queue",),
+    "rename": ("selected_song", "role_assignments", "custom_roles", "role_counts"),
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+_lock_depth = {}    # vc_id -> nesting depth while this process holds the flock
+_journal_len = {}
+_seq_cache = {}     # vc_id -> (fingerprint, latest seq)
+_parsed_cache = {}  # vc_id -> (fingerprint, parsed state)
+
+
+def snapshot_path(vc_id):
+    return f"queue_{vc_id}.json"
+
+
+def journal_path(vc_id):
+    return f"queue_{vc_id}.oplog"
+
+
+def lock_path(vc_id):
+    return f"queue_{vc_id}.lock"
+
+
+def _thread_lock(vc_id):
+    with _locks_guard:
+        if vc_id not in _locks:
+            _locks[vc_id] = threading.RLock()
+        return _locks[vc_id]
+
+
+@contextmanager
+def _vc_lock(vc_id):
+    """Exclusive access to a VC's files for this thread and other processes.
+
+    Re-entrant: the flock is taken by the outermost call only, since a second
+    flock from the same process on a new file descriptor would block on itself.
+    """
+    with _thread_lock(vc_id):
+        depth = _lock_depth.get(vc_id, 0)
+        _lock_depth[vc_id] = depth + 1
+        try:
+            if depth:
+                yield
+            else:
+                with file_lock(lock_path(vc_id)):
+                    yield
+        finally:
+            if depth:
+                _lock_depth[vc_id] = depth
+            else:
+                del _lock_depth[vc_id]
+
+
+def _stat_key(path):
+    try:
+        st_ = os.stat(path)
+    except OSError:
+        return None
+    return (st_.st_mtime_ns, st_.st_size, st_.st_ino)
+
+
+def file_fingerprint(vc_id):
+    """Cheap change marker for a VC built from file metadata only"""
+    return (_stat_key(snapshot_path(vc_id)), _stat_key(journal_path(vc_id)))
+
+
+def default_state():
+    return {
+        "queue": Roster(),
+        "calypso": Roster(),
+        "pinged": set(),
+        "current_manager": "",
+        "current_template": "Default EPIC",
+        "last_modified": time.time(),
+        "selected_song": "",
+        "role_assignments": {},
+        "custom_roles": {},
+        "custom_reactions": {},
+        "role_undo": [],
+        "role_redo": [],
+        "role_counts": {},
+        "waiting_since": {},
+        "turn_started": None,
+        "last_turn": None,
+        "seq": 0,
+        "field_versions": {},
+    }
+
+
+class StateConflict(Exception):
+    """Raised when an operation was based on a version that is out of date"""
+
+    def __init__(self, vc_id, fields):
+        self.vc_id = vc_id
+        self.fields = sorted(fields)
+        super().__init__(f"{vc_id}: {', '.join(self.fields)} changed by someone else")
+
+
+def state_from_dict(data):
+    """Build an in-memory state from its JSON form"""
+    return {
+        "queue": Roster(data.get("queue", [])),
+        "calypso": Roster(data.get("calypso", [])),
+        "pinged": set(data.get("pinged", [])),
+        "current_manager": data.get("current_manager", ""),
+        "current_template": data.get("current_template", "Default EPIC"),
+        "last_modified": data.get("last_modified", 0),
+        "selected_song": data.get("selected_song", ""),
+        "role_assignments": data.get("role_assignments", {}),
+        "custom_roles": data.get("custom_roles", {}),
+        "custom_reactions": data.get("custom_reactions", {}),
+        "role_undo": data.get("role_undo", []),
+        "role_redo": data.get("role_redo", []),
+        "role_counts": data.get("role_counts", {}),
+        "waiting_since": data.get("waiting_since", {}),
+        "turn_started": data.get("turn_started"),
+        "last_turn": data.get("last_turn"),
+        "seq": data.get("seq", 0),
+        "field_versions": data.get("field_versions", {}),
+    }
+
+
+def state_to_dict(state):
+    """JSON form of an in-memory state"""
+    return {
+        "queue": list(state["queue"]),
+        "calypso": list(state["calypso"]),
+        "pinged": list(state["pinged"]),
+        "current_manager": state["current_manager"],
+        "current_template": state["current_template"],
+        "last_modified": state.get("last_modified", time.time()),
+        "selected_song": state.get("selected_song", ""),
+        "role_assignments": state.get("role_assignments", {}),
+        "custom_roles": state.get("custom_roles", {}),
+        "custom_reactions": state.get("custom_reactions", {}),
+        "role_undo": state.get("role_undo", []),
+        "role_redo": state.get("role_redo", []),
+        "role_counts": state.get("role_counts", {}),
+        "waiting_since": state.get("waiting_since", {}),
+        "turn_started": state.get("turn_started"),
+        "last_turn": state.get("last_turn"),
+        "seq": state.get("seq", 0),
+        "field_versions": state.get("field_versions", {}),
+    }
+
+
+def copy_state(state):
+    """Copy of state that apply_op can change without touching the original.
+
+    Only the containers operations change in place are copied; everything
+    else is replaced wholesale by operations and can be shared.
+    """
+    copied = dict(state)
+    copied["queue"] = state["queue"].copy()
+    copied["calypso"] = state["calypso"].copy()
+    copied["pinged"] = set(state["pinged"])
+    for field in ("waiting_since", "field_versions", "role_counts"):
+        copied[field] = dict(state.get(field, {}))
+    for field in ("role_undo", "role_redo"):
+        copied[field] = list(state.get(field, []))
+    return copied
+
+
+def op_fields(op):
+    """State fields an operation writes"""
+    if op["op"] == "set":
+        return tuple(f for f in op["fields"] if f in SETTABLE_FIELDS)
+    return OP_FIELDS.get(op["op"], ())
+
+
+def check_conflict(vc_id, state, op, base_version):
+    """Raise StateConflict if op, based on base_version, would clobber newer writes"""
+    if base_version is None or base_version >= state.get("seq", 0):
+        return
+    if op["op"] in REBASE_SAFE_OPS:
+        return
+    field_versions = state.get("field_versions", {})
+    stale = [f for f in op_fields(op) if field_versions.get(f, 0) > base_version]
+    if stale:
+        raise StateConflict(vc_id, stale)
+
+
+def role_diff(state, fields):
+    """Compact diff of the song/role changes a "set" would make.
+
+    Only the song and the roles whose people change are stored, as
+    ``[before, after]`` pairs (``None`` for a role that is not assigned).
+    """
+    diff = {}
+    if "selected_song" in fields and fields["selected_song"] != state.get("selected_song", ""):
+        diff["song"] = [state.get("selected_song", ""), fields["selected_song"]]
+    if "role_assignments" in fields:
+        before = state.get("role_assignments", {})
+        after = fields["role_assignments"]
+        roles = {
+            role: [before.get(role), after.get(role)]
+            for role in before.keys() | after.keys()
+            if before.get(role) != after.get(role)
+        }
+        if roles:
+            diff["roles"] = roles
+    return diff
+
+
+def _apply_role_diff(state, diff, side):
+    """Move song/roles to one side (0 = before, 1 = after) of a diff"""
+    if "song" in diff:
+        state["selected_song"] = diff["song"][side]
+    if "roles" in diff:
+        assignments = dict(state.get("role_assignments", {}))
+        for role, values in diff["roles"].items():
+            if values[side] is None:
+                assignments.pop(role, None)
+            else:
+                assignments[role] = values[side]
+        state["role_assignments"] = assignments
+
+
+def _record_role_change(state, diff):
+    undo = state.setdefault("role_undo", [])
+    undo.append(diff)
+    if len(undo) > ROLE_UNDO_LIMIT:
+        del undo[:len(undo) - ROLE_UNDO_LIMIT]
+    state["role_redo"] = []
+
+
+def _rename_state(state, songs, roles):
+    """Replace old song and role names everywhere they are saved"""
+    song = state.get("selected_song", "")
+    state["selected_song"] = songs.get(song, song)
+    state["role_assignments"] = {roles.get(r, r): p for r, p in state.get("role_assignments", {}).items()}
+    custom_roles = {}
+    for title, custom in state.get("custom_roles", {}).items():
+        custom = dict(custom)
+        if "roles" in custom:
+            custom["roles"] = [roles.get(r, r) for r in custom["roles"]]
+        if "icons" in custom:
+            custom["icons"] = {roles.get(r, r): icon for r, icon in custom["icons"].items()}
+        custom_roles[songs.get(title, title)] = custom
+    state["custom_roles"] = custom_roles
+    role_counts = {}
+    for person, counts in state.get("role_counts", {}).items():
+        renamed = {}
+        for role, n in counts.items():
+            role = roles.get(role, role)
+            renamed[role] = renamed.get(role, 0) + n
+        role_counts[person] = renamed
+    state["role_counts"] = role_counts
+    for stack in ("role_undo", "role_redo"):
+        diffs = []
+        for diff in state.get(stack, []):
+            diff = dict(diff)
+            if "song" in diff:
+                diff["song"] = [songs.get(t, t) for t in diff["song"]]
+            if "roles" in diff:
+                diff["roles"] = {roles.get(r, r): v for r, v in diff["roles"].items()}
+            diffs.append(diff)
+        state[stack] = diffs
+
+
+def apply_op(state, op):
+    """Apply a single queue operation to state in place.
+
+    Operations are plain dicts with an ``op`` key; the same function is used
+    for live actions and for journal replay, so both always agree.
+    """
+    kind = op["op"]
+    name = op.get("name", "")
+    queue, calypso = state["queue"], state["calypso"]
+    ts = op.get("ts", state.get("last_modified", 0))
+    waiting_since = state.setdefault("waiting_since", {})
+    if kind == "join":
+        if name and name not in calypso and queue.append(name):
+            waiting_since[name_key(name)] = ts
+    elif kind == "leave":
+        state["pinged"].discard(queue.remove(name) or name)
+        waiting_since.pop(name_key(name), None)
+    elif kind == "hold":
+        held = queue.remove(name)
+        if held is not None:
+            calypso.append(held)
+            waiting_since.pop(name_key(name), None)
+    elif kind == "return":
+        returned = calypso.remove(name)
+        if returned is not None:
+            queue.append(returned)
+            waiting_since[name_key(name)] = ts
+    elif kind == "move":
+        queue.move(name, op["position"])
+    elif kind == "ping":
+        # "on" makes the ping idempotent; older journal records just toggle
+        on = op.get("on", name not in state["pinged"])
+        if on:
+            state["pinged"].add(name)
+        else:
+            state["pinged"].discard(name)
+    elif kind == "advance":
+        if queue:
+            # What was just sung, so analytics can log it from the committed state
+            singer = queue[0]
+            state["last_turn"] = {
+                "seq": op.get("seq"),
+                "ts": ts,
+                "singer": singer,
+                "song": state.get("selected_song", ""),
+                "role_assignments": state.get("role_assignments", {}),
+                "joined": waiting_since.get(name_key(singer)),
+                "started": state.get("turn_started"),
+                "queue_len": len(queue),
+            }
+            # The singer goes to the back and waits again; the next one starts now
+            waiting_since[name_key(queue.rotate())] = ts
+            state["turn_started"] = ts
+            # The roles of the song that was just sung count towards fair auto-assign
+            record_roles_sung(state.setdefault("role_counts", {}), state.get("role_assignments", {}), UNASSIGNED)
+            state["selected_song"] = ""
+            state["role_assignments"] = {}
+            state["role_undo"] = []
+            state["role_redo"] = []
+    elif kind == "clear":
+        queue.clear()
+        calypso.clear()
+        state["pinged"].clear()
+        waiting_since.clear()
+        state["turn_started"] = None
+    elif kind == "reorder":
+        state["queue"] = Roster(op["queue"])
+    elif kind == "undo":
+        if state.get("role_undo"):
+            diff = state["role_undo"].pop()
+            _apply_role_diff(state, diff, 0)
+            state.setdefault("role_redo", []).append(diff)
+    elif kind == "redo":
+        if state.get("role_redo"):
+            diff = state["role_redo"].pop()
+            _apply_role_diff(state, diff, 1)
+            state.setdefault("role_undo", []).append(diff)
+    elif kind == "rename":
+        _rename_state(state, op.get("songs", {}), op.get("roles", {}))
+    elif kind == "set":
+        diff = role_diff(state, op["fields"])
+        if diff:
+            _record_role_change(state, diff)
+        for field, value in op["fields"].items():
+            if field in SETTABLE_FIELDS:
+                state[field] = value
+    else:
+        raise ValueError(f"Unknown queue operation: {kind}")
+    if "ts" in op:
+        state["last_modified"] = op["ts"]
+    if "seq" in op:
+        state["seq"] = op["seq"]
+        field_versions = state.setdefault("field_versions", {})
+        for field in op_fields(op):
+            field_versions[field] = op["seq"]
+    return state
+
+
+def _read_journal(vc_id):
+    """Yield journal records, skipping a torn last line left by a crash"""
+    path = journal_path(vc_id)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _journal_tail(vc_id):
+    """Return the last complete journal record without reading the whole file.
+
+    Reads backwards one block at a time until a whole line parses, so a
+    record larger than a block is still found.
+    """
+    path = journal_path(vc_id)
+    try:
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b""
+            while pos > 0:
+                step = min(TAIL_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+                lines = data.split(b"\n")
+                # The first piece may be the end of a longer line, unless the file starts there
+                for line in reversed(lines if pos == 0 else lines[1:]):
+                    if line.strip():
+                        try:
+                            return json.loads(line)
+                        except ValueError:
+                            continue
+    except OSError:
+        return None
+    return None
+
+
+def _cut_torn_tail(f):
+    """Make a journal opened in "a+b" end with a newline before appending.
+
+    A crash mid-append leaves a torn last line; writing the next record onto
+    it would make both unreadable, so the fragment is cut off. A complete
+    record that only lacks its newline is kept.
+    """
+    end = f.seek(0, os.SEEK_END)
+    if end == 0:
+        return
+    f.seek(end - 1)
+    if f.read(1) == b"\n":
+        return
+    pos = cut = end
+    while pos > 0 and cut == end:
+        step = min(TAIL_BLOCK, pos)
+        pos -= step
+        f.seek(pos)
+        newline = f.read(step).rfind(b"\n")
+        if newline >= 0:
+            cut = pos + newline + 1
+    if cut == end:
+        cut = 0
+    f.seek(cut)
+    try:
+        json.loads(f.read())
+    except ValueError:
+        f.truncate(cut)
+    else:
+        f.write(b"\n")
+
+
+def _read_snapshot(vc_id):
+    save_file = snapshot_path(vc_id)
+    if os.path.exists(save_file):
+        with open(save_file, "r", encoding="utf-8") as f:
+            return state_from_dict(json.load(f))
+    return None
+
+
+@timed("queue_state.load_state")
+def load_state(vc_id):
+    """Load state for specific VC: snapshot plus replayed journal.
+
+    The result is shared with the cache; use ``copy_state`` before changing it.
+    """
+    with _vc_lock(vc_id):
+        fingerprint = file_fingerprint(vc_id)
+        cached = _parsed_cache.get(vc_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        state = _read_snapshot(vc_id) or default_state()
+        count = 0
+        for record in _read_journal(vc_id):
+            count += 1
+            if record.get("seq", 0) > state["seq"] and record.get("op") != "snapshot":
+                apply_op(state, record)
+        _journal_len[vc_id] = count
+        _parsed_cache[vc_id] = (fingerprint, state)
+        _seq_cache[vc_id] = (fingerprint, state["seq"])
+        return state
+
+
+@timed("queue_state.save_state")
+def save_state(vc_id, state):
+    """Write a full snapshot for a VC and reset its journal"""
+    with _vc_lock(vc_id):
+        seq = max(state.get("seq", 0), latest_seq(vc_id))
+        data = state_to_dict(state)
+        data["seq"] = seq
+        data["last_modified"] = time.time()
+        save_file = snapshot_path(vc_id)
+        tmp_file = save_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, save_file)
+        # Keep a marker so the latest sequence number stays readable from the tail
+        with open(journal_path(vc_id), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": seq, "op": "snapshot"}) + "\n")
+        _journal_len[vc_id] = 1
+
+
+def latest_seq(vc_id):
+    """Sequence number of the newest operation recorded for a VC"""
+    fingerprint = file_fingerprint(vc_id)
+    cached = _seq_cache.get(vc_id)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    tail = _journal_tail(vc_id)
+    if tail is not None:
+        seq = tail.get("seq", 0)
+    else:
+        snapshot = _read_snapshot(vc_id)
+        seq = snapshot["seq"] if snapshot else 0
+    _seq_cache[vc_id] = (fingerprint, seq)
+    return seq
+
+
+@timed("queue_state.commit_op")
+def commit_op(vc_id, state, op, base_version=None):
+    """Append op to the VC's journal and return the resulting new state.
+
+    state itself is left untouched, so readers holding it never see a half
+    applied operation. base_version is the version the caller's view was
+    based on; see ``check_conflict``.
+    """
+    with _vc_lock(vc_id):
+        seq = latest_seq(vc_id)
+        if state.get("seq", 0) != seq:
+            # Someone else wrote in the meantime: apply on top of their changes
+            state = load_state(vc_id)
+        check_conflict(vc_id, state, op, base_version)
+        record = dict(op)
+        record["seq"] = seq + 1
+        record["ts"] = time.time()
+        state = apply_op(copy_state(state), record)
+        with open(journal_path(vc_id), "a+b") as f:
+            _cut_torn_tail(f)
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        # Still under the flock, so no other process's write is in this fingerprint
+        fingerprint = file_fingerprint(vc_id)
+        _seq_cache[vc_id] = (fingerprint, record["seq"])
+        _parsed_cache[vc_id] = (fingerprint, state)
+        if vc_id not in _journal_len:
+            _journal_len[vc_id] = sum(1 for _ in _read_journal(vc_id))
+        else:
+            _journal_len[vc_id] += 1
+        if _journal_len[vc_id] >= COMPACT_EVERY:
+            _journal_len[vc_id] = 0  # Avoid scheduling twice while compacting
+            threading.Thread(target=compact, args=(vc_id,), daemon=True).start()
+    return state
+
+
+def compact(vc_id):
+    """Fold the journal into a fresh snapshot"""
+    with _vc_lock(vc_id):
+        save_state(vc_id, load_state(vc_id))
@@ -0,0 +1,104 @@
+"""Recording of real traffic for offline replay.
+
+While recording, every rerun of a VC tab (``render``) and every
+state-changing action (``op``) is appended to a JSON-lines trace in
+``traces/`` with the seconds since recording started, a per-session token
+and the VC. An op also stores how many versions the session's view was
+behind, so a replay can reproduce stale edits and conflicts. The first time
+a VC shows up, its full state is written too, so a trace replays from the
+same starting point.
+
+Recording is off by default and costs one check per call while off. Start
+it from the admin panel or with ``QUEUE_RECORD=1``. Replay a trace with
+``benchmarks/replay.py``.
+
+Traces contain the names people typed; treat them like the queue files.
+"""
+import json
+import os
+import threading
+import time
+
+from queue_state import state_to_dict
+
+TRACE_DIR = "traces"
+TRACE_VERSION = 1
+
+_file = None
+_path = None
+_start = 0.0
+_seen = set()
+_lock = threading.Lock()
+
+
+def recording():
+    """Path of the trace being written, or None"""
+    return _path
+
+
+def start(directory=TRACE_DIR):
+    """Begin a new trace file and return its path"""
+    global _file, _path, _start
+    stop()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, time.strftime("trace-%Y%m%d-%H%M%S.jsonl"))
+    with _lock:
+        _file = open(path, "a", encoding="utf-8", buffering=1)  # Line-buffered: a crash keeps what was recorded
+        _path = path
+        _start = time.monotonic()
+        _seen.clear()
+        _file.write(json.dumps({"trace": TRACE_VERSION, "started": time.time()}) + "\n")
+    return path
+
+
+def stop():
+    global _file, _path
+    with _lock:
+        if _file is not None:
+            _file.close()
+        _file = None
+        _path = None
+
+
+def _write(event, vc_id, state):
+    with _lock:
+        if _file is None:
+            return
+        t = round(time.monotonic() - _start, 4)
+        if vc_id not in _seen:
+            _seen.add(vc_id)
+            _file.write(json.dumps({"t": t, "kind": "state", "vc": vc_id, "state": state_to_dict(state)}, ensure_ascii=False) + "\n")
+        event["t"] = t
+        _file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def record_render(session, vc_id, state):
+    """A rerun of a VC tab by session"""
+    if _file is not None:
+        _write({"kind": "render", "session": session, "vc": vc_id}, vc_id, state)
+
+
+def record_op(session, vc_id, op, behind, state):
+    """A state-changing action based on a view behind versions old"""
+    if _file is not None:
+        _write({"kind": "op", "session": session, "vc": vc_id, "op": op, "behind": behind}, vc_id, state)
+
+
+def load(path):
+    """(header, events) of a trace file, skipping a torn last line"""
+    header, events = {}, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "trace" in record:
+                header = record
+            else:
+                events.append(record)
+    return header, events
+
+
+if os.environ.get("QUEUE_RECORD", "") not in ("", "0"):
+    start()
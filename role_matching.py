@@ -0,0 +1,114 @@
+"""Fair automatic role assignment.
+
+Roles are matched to people as a minimum-cost bipartite matching (Hungarian
+algorithm with potentials, O(roles² × people)). A person's cost for a role
+grows with how often they already sang that role and how many roles they
+sang overall, so the assignment spreads roles around the room.
+
+The history is a per-VC counter ``{person key: {role: times sung}}`` that is
+updated when the queue advances, so building the cost matrix is a handful of
+dict lookups per cell instead of a scan over past songs.
+"""
+import heapq
+
+from roster import name_key
+
+SAME_ROLE_WEIGHT = 10.0  # Cost per earlier time a person sang this exact role
+ANY_ROLE_WEIGHT = 1.0    # Cost per role a person sang in total
+QUEUE_WEIGHT = 0.001     # Tie-break: prefer people further up the queue
+
+
+def assigned_people(people, unassigned):
+    """People filling a role; older states store a single name instead of a list"""
+    pool = people if isinstance(people, list) else [people]
+    return [person for person in pool if person and person != unassigned]
+
+
+def record_roles_sung(role_counts, role_assignments, unassigned):
+    """Add one performance of the given role assignments to the history"""
+    for role, people in role_assignments.items():
+        for person in assigned_people(people, unassigned):
+            # A new inner dict, so states that share the old one don't change
+            key = name_key(person)
+            counts = dict(role_counts.get(key, {}))
+            counts[role] = counts.get(role, 0) + 1
+            role_counts[key] = counts
+
+
+def hungarian(cost):
+    """Column chosen for each row of cost (rows <= columns) at minimum total"""
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n > m:
+        raise ValueError("hungarian() needs at least as many columns as rows")
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match = [0] * (m + 1)  # match[j] = row (1-based) assigned to column j
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = cost[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    result = [0] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            result[match[j] - 1] = j - 1
+    return result
+
+
+def fair_assignment(roles, people, role_counts):
+    """Give each role one person (each person at most one role) as fairly as possible.
+
+    people is in queue order. When there are more roles than people, the roles
+    listed first are filled.
+    """
+    roles = list(roles)
+    people = list(people)
+    if not roles or not people:
+        return {}
+    histories = [role_counts.get(name_key(p), {}) for p in people]
+    totals = [sum(h.values()) for h in histories]
+    base = [ANY_ROLE_WEIGHT * total + QUEUE_WEIGHT * pos for pos, total in enumerate(totals)]
+    filled = roles[:len(people)]
+    full = [
+        [base[j] + SAME_ROLE_WEIGHT * histories[j].get(role, 0) for j in range(len(people))]
+        for role in filled
+    ]
+    # Some optimal matching only uses each role's len(filled) cheapest people
+    # (any other pick could be swapped for one of those still free), so the
+    # matrix is cut down to their union before solving
+    k = len(filled)
+    columns = sorted({j for row in full for j in heapq.nsmallest(k, range(len(people)), key=row.__getitem__)})
+    picks = hungarian([[row[j] for j in columns] for row in full])
+    return {role: [people[columns[j]]] for role, j in zip(filled, picks)}
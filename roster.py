@@ -0,0 +1,140 @@
+"""Ordered roster of names used for the queue and the Calypso list.
+
+Names are kept in order in an ``OrderedDict`` keyed by a normalized form of
+the name (Unicode NFKC, casefolded, whitespace collapsed), so "Alice" and
+"alice " are the same person. Membership, append, removal and rotating the
+first person to the back are O(1); moving someone to the front or back is
+O(1) and to any other position costs only the people behind that position.
+
+A roster reads like a list of display names (indexing, slicing, iteration,
+``len``, ``==`` against lists) and is stored as a plain list, so existing
+``queue``/``calypso`` data loads unchanged.
+"""
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Sequence
+from itertools import islice
+
+
+def name_key(name):
+    """Normalized form of a name used for matching people"""
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+class Roster(Sequence):
+    """Ordered list of unique names with a hash index over normalized names"""
+
+    __slots__ = ("_items",)
+
+    def __init__(self, names=()):
+        self._items = OrderedDict()
+        for name in names:
+            self.append(name)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __reversed__(self):
+        return reversed(self._items.values())
+
+    def __contains__(self, name):
+        return isinstance(name, str) and name_key(name) in self._items
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        size = len(self._items)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("roster index out of range")
+        if index > size // 2:
+            return next(islice(reversed(self._items.values()), size - 1 - index, None))
+        return next(islice(self._items.values(), index, None))
+
+    def __eq__(self, other):
+        if isinstance(other, (Roster, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return f"Roster({list(self)!r})"
+
+    def index(self, name, start=0, stop=None):
+        key = name_key(name)
+        for i, other in enumerate(islice(self._items, start, stop), start):
+            if other == key:
+                return i
+        raise ValueError(f"{name!r} is not in roster")
+
+    def get(self, name):
+        """Stored spelling of name, or None if they are not on the roster"""
+        return self._items.get(name_key(name))
+
+    def append(self, name):
+        """Add name at the end; returns False if they are already on the roster"""
+        key = name_key(name)
+        if not key or key in self._items:
+            return False
+        self._items[key] = name
+        return True
+
+    def remove(self, name):
+        """Remove name and return its stored spelling, or None if absent"""
+        return self._items.pop(name_key(name), None)
+
+    def rotate(self):
+        """Move the first person to the back and return them"""
+        if not self._items:
+            return None
+        key = next(iter(self._items))
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def move(self, name, position):
+        """Move name to position (clamped to the roster); returns False if absent"""
+        key = name_key(name)
+        if key not in self._items:
+            return False
+        position = max(0, min(position, len(self._items) - 1))
+        if position == 0:
+            self._items.move_to_end(key, last=False)
+            return True
+        self._items.move_to_end(key)
+        # Everyone from position onwards goes behind it again
+        behind = list(islice(self._items, position, len(self._items) - 1))
+        for other in behind:
+            self._items.move_to_end(other)
+        return True
+
+    def clear(self):
+        self._items.clear()
+
+    def copy(self):
+        """Independent roster with the same names in the same order"""
+        other = Roster.__new__(Roster)
+        other._items = self._items.copy()
+        return other
+
+    def to_list(self):
+        return list(self)
+
+
+def find_move(before, after):
+    """(name, position) if after is before with one person moved, else None"""
+    if len(before) != len(after) or list(before) == list(after):
+        return None
+    before, after = list(before), list(after)
+    start = next(i for i, (a, b) in enumerate(zip(before, after)) if a != b)
+    end = len(before) - next(i for i, (a, b) in enumerate(zip(reversed(before), reversed(after))) if a != b)
+    if before[start] == after[end - 1] and before[start + 1:end] == after[start:end - 1]:
+        return before[start], end - 1  # Moved down
+    if after[start] == before[end - 1] and before[start:end - 1] == after[start + 1:end]:
+        return after[start], start  # Moved up
+    return None
@@ -0,0 +1,86 @@
+"""Search index for the karaoke catalog.
+
+Titles are indexed once: an inverted index from word tokens to songs for
+whole-word matches, and a character-trigram index for substring matches and
+typos. A query only looks at songs that share a token or trigram with it, so
+lookups stay well under a millisecond for catalogs of thousands of songs.
+Recent queries are answered from an LRU cache.
+"""
+import functools
+import re
+from collections import Counter
+
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_WORD = re.compile(r"[^\w]+")
+
+MIN_TYPO_SIMILARITY = 0.35  # Trigram similarity needed for a fuzzy-only match
+
+
+def normalize(text):
+    """Casefolded text with punctuation collapsed to single spaces"""
+    text = _APOSTROPHES.sub("", text.casefold())
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SongIndex:
+    """Ranked fuzzy lookup of songs (dicts with a "title") by title"""
+
+    def __init__(self, songs, cache_size=512):
+        self.songs = list(songs)
+        self._titles = [normalize(song["title"]) for song in self.songs]
+        self._tokens = {}
+        self._grams = {}
+        self._gram_counts = []
+        for idx, title in enumerate(self._titles):
+            for token in set(title.split()):
+                self._tokens.setdefault(token, []).append(idx)
+            grams = trigrams(title)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(idx)
+        self._search = functools.lru_cache(maxsize=cache_size)(self._rank)
+
+    def _rank(self, query, k):
+        if not query:
+            return ()
+        q_tokens = set(query.split())
+        q_grams = trigrams(query)
+        shared = Counter()
+        for gram in q_grams:
+            shared.update(self._grams.get(gram, ()))
+        token_hits = Counter()
+        for token in q_tokens:
+            token_hits.update(self._tokens.get(token, ()))
+
+        if len(query) < 3:
+            candidates = range(len(self.songs))  # Too short to have been indexed by trigram
+        else:
+            candidates = shared.keys() | token_hits.keys()
+        scored = []
+        for idx in candidates:
+            title = self._titles[idx]
+            if query in title:
+                score = len(query) / len(title) * 100 + 50
+            else:
+                score = token_hits[idx] / len(q_tokens) * 100
+                similarity = 2 * shared[idx] / (len(q_grams) + self._gram_counts[idx])
+                if similarity >= MIN_TYPO_SIMILARITY:
+                    score = max(score, similarity * 50)
+            if score > 0:
+                scored.append((-score, idx))
+        scored.sort()
+        return tuple((-neg, self.songs[idx]) for neg, idx in scored[:k])
+
+    def search(self, query, k=5):
+        """Best k (score, song) pairs for query, highest score first"""
+        return self._search(normalize(query or ""), k)
+
+    def best(self, query):
+        """Single best matching song, or None"""
+        results = self.search(query, 1)
+        return results[0][1] if results else None
@@ -0,0 +1,523 @@
+"""Pluggable storage for queue state and templates.
+
+Two backends implement the same small interface:
+
+* ``JsonBackend`` – the original loose files in the working directory
+  (``queue_{vc_id}.json`` + journal from ``queue_state``,
+  ``templates/*.json`` and ``rooms.json``).
+* ``SqliteBackend`` – one SQLite database in WAL mode with a row per VC, a
+  version column for cheap change polling, a templates table and a rooms
+  table.
+
+The backend is chosen with ``QUEUE_STORAGE`` (``json``, ``sqlite`` or
+``sqlite:<path>``). Existing JSON data can be imported with::
+
+    python storage.py migrate --db queue.db
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import queue_state
+from profiling import timed
+from queue_state import StateConflict, apply_op, check_conflict, copy_state, default_state, state_from_dict, state_to_dict
+
+DEFAULT_DB_PATH = "queue.db"
+ROOMS_FILE = "rooms.json"
+
+# Rooms every deployment starts with; more can be created at runtime
+DEFAULT_ROOMS = [
+    {"id": "vc1", "name": "VC 1"},
+    {"id": "vc2", "name": "VC 2"},
+]
+
+
+class JsonBackend:
+    """Loose JSON files: per-VC snapshot + journal, one file per template"""
+
+    def __init__(self, templates_dir="templates"):
+        self.templates_dir = templates_dir
+        os.makedirs(templates_dir, exist_ok=True)
+
+    # ----- queue state -----
+    def load(self, vc_id):
+        return queue_state.load_state(vc_id)
+
+    def latest_version(self, vc_id):
+        return queue_state.latest_seq(vc_id)
+
+    def commit(self, vc_id, state, op, base_version=None):
+        return queue_state.commit_op(vc_id, state, op, base_version)
+
+    def vc_ids(self):
+        found = set()
+        for path in glob.glob("queue_*.json") + glob.glob("queue_*.oplog"):
+            found.add(os.path.splitext(os.path.basename(path))[0][len("queue_"):])
+        return sorted(found)
+
+    # ----- templates -----
+    def _template_file(self, name):
+        return os.path.join(self.templates_dir, f"{name}.json")
+
+    def read_template(self, name):
+        template_file = self._template_file(name)
+        if os.path.exists(template_file):
+            with open(template_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def write_template(self, name, data):
+        # Write + rename so the directory mtime changes even for existing templates
+        template_file = self._template_file(name)
+        with open(template_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(template_file + ".tmp", template_file)
+
+    def remove_template(self, name):
+        # Strip out any directory traversal attempts like ../ or ..\
+        file_path = self._template_file(os.path.basename(name))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            return True
+        # If it still fails, check if the file literal name on disk is exactly the broken string
+        fallback_path = self._template_file(name)
+        if os.path.exists(fallback_path):
+            os.remove(fallback_path)
+            return True
+        return False
+
+    def template_names(self):
+        if not os.path.exists(self.templates_dir):
+            return []
+        return [f[:-len(".json")] for f in os.listdir(self.templates_dir) if f.endswith(".json")]
+
+    def templates_stamp(self):
+        """Changes whenever a template file is added, replaced or removed"""
+        try:
+            return os.stat(self.templates_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    # ----- rooms -----
+    def room_list(self):
+        if os.path.exists(ROOMS_FILE):
+            with open(ROOMS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return []
+
+    def add_room(self, room_id, name):
+        rooms = self.room_list() + [{"id": room_id, "name": name}]
+        tmp_file = ROOMS_FILE + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(rooms, f, indent=2)
+        os.replace(tmp_file, ROOMS_FILE)
+
+
+class SqliteBackend:
+    """SQLite database in WAL mode: concurrent reads, transactional writes"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vc_state (
+            vc_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            last_modified REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS templates (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rooms (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    POOL_SIZE = 4  # Connections kept open; WAL lets them read concurrently
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        # Streamlit runs every rerun on a new thread, so connections are pooled
+        # and shared between threads instead of opened per thread
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _connection(self):
+        """Borrow a pooled connection; at most POOL_SIZE are ever opened"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                create = self._opened < self.POOL_SIZE
+                if create:
+                    self._opened += 1
+            if create:
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA synchronous=NORMAL")
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    # ----- queue state -----
+    def _row_to_state(self, row):
+        state = state_from_dict(json.loads(row[1]))
+        state["seq"] = row[0]
+        return state
+
+    def load(self, vc_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT version, data FROM vc_state WHERE vc_id = ?", (vc_id,)
+            ).fetchone()
+        return self._row_to_state(row) if row else default_state()
+
+    def latest_version(self, vc_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT version FROM vc_state WHERE vc_id = ?", (vc_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def put(self, vc_id, state):
+        """Write a whole state row (used by the migration)"""
+        with self._connection() as conn:
+            self._put(conn, vc_id, state)
+
+    def _put(self, conn, vc_id, state):
+        data = state_to_dict(state)
+        conn.execute(
+            "INSERT INTO vc_state (vc_id, version, last_modified, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(vc_id) DO UPDATE SET version = excluded.version, "
+            "last_modified = excluded.last_modified, data = excluded.data",
+            (vc_id, data["seq"], data["last_modified"], json.dumps(data, ensure_ascii=False)),
+        )
+
+    def commit(self, vc_id, state, op, base_version=None):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT version, data FROM vc_state WHERE vc_id = ?", (vc_id,)
+                ).fetchone()
+                version = row[0] if row else 0
+                if state.get("seq", 0) != version:
+                    # Someone else wrote in the meantime: apply on top of their changes
+                    state = self._row_to_state(row) if row else default_state()
+                check_conflict(vc_id, state, op, base_version)
+                record = dict(op)
+                record["seq"] = version + 1
+                record["ts"] = time.time()
+                state = apply_op(copy_state(state), record)
+                self._put(conn, vc_id, state)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return state
+
+    def vc_ids(self):
+        with self._connection() as conn:
+            return [r[0] for r in conn.execute("SELECT vc_id FROM vc_state ORDER BY vc_id")]
+
+    # ----- templates -----
+    def read_template(self, name):
+        with self._connection() as conn:
+            row = conn.execute("SELECT data FROM templates WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _bump(self, conn, key):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1",
+            (key,),
+        )
+
+    def write_template(self, name, data):
+        with self._connection() as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO templates (name, data) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                (name, json.dumps(data, ensure_ascii=False)),
+            )
+            self._bump(conn, "templates_version")
+
+    def remove_template(self, name):
+        with self._connection() as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute("DELETE FROM templates WHERE name = ?", (name,)).rowcount > 0
+            self._bump(conn, "templates_version")
+        return removed
+
+    def template_names(self):
+        with self._connection() as conn:
+            return [r[0] for r in conn.execute("SELECT name FROM templates ORDER BY rowid")]
+
+    def templates_stamp(self):
+        """Counter bumped by every template write or delete"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'templates_version'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    # ----- rooms -----
+    def room_list(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT id, name FROM rooms ORDER BY rowid").fetchall()
+        return [{"id": r[0], "name": r[1]} for r in rows]
+
+    def add_room(self, room_id, name):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO rooms (id, name) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+                (room_id, name),
+            )
+
+
+def open_backend(spec="json", templates_dir="templates"):
+    """Create the backend named by spec: json, sqlite or sqlite:<path>"""
+    kind, _, target = (spec or "json").partition(":")
+    if kind == "json":
+        return JsonBackend(templates_dir=templates_dir)
+    if kind == "sqlite":
+        return SqliteBackend(target or DEFAULT_DB_PATH)
+    raise ValueError(f"Unknown storage backend: {spec}")
+
+
+def migrate(db_path=DEFAULT_DB_PATH, templates_dir="templates"):
+    """Import queue_*.json (+ journals), templates/*.json and rooms.json into SQLite"""
+    source = JsonBackend(templates_dir=templates_dir)
+    target = SqliteBackend(db_path)
+    for room in source.room_list():
+        target.add_room(room["id"], room["name"])
+    rooms = source.vc_ids()
+    for vc_id in rooms:
+        target.put(vc_id, source.load(vc_id))
+    names = source.template_names()
+    for name in names:
+        target.write_template(name, source.read_template(name))
+    return rooms, names
+
+
+class TemplateCatalog:
+    """Templates loaded once per process and indexed by name.
+
+    Saves and deletes made through the catalog update the index directly;
+    changes made elsewhere are noticed through the backend's templates stamp
+    (directory mtime or a version counter), checked at most once every
+    ``refresh_interval`` seconds.
+    """
+
+    def __init__(self, backend, refresh_interval=1.0):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self._index = None
+        self._stamp = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        # One read of the attribute: save() and delete() may replace it at any moment
+        index = self._index
+        now = time.monotonic()
+        if index is not None and now - self._checked_at < self.refresh_interval:
+            return index
+        with self._lock:
+            self._checked_at = now
+            stamp = self.backend.templates_stamp()
+            if self._index is None or stamp != self._stamp:
+                self._load(stamp)
+            return self._index
+
+    def _load(self, stamp):
+        """Read every template into a new index (caller holds the lock)"""
+        index = {}
+        for name in self.backend.template_names():
+            data = self.backend.read_template(name)
+            if data is not None:
+                index[name] = data
+        self._index = index
+        self._stamp = stamp
+
+    def names(self):
+        return list(self._current())
+
+    def get(self, name):
+        """Copy of a template, or None if it does not exist"""
+        template = self._current().get(name)
+        return dict(template) if template is not None else None
+
+    def save(self, name, data):
+        with self._lock:
+            # Not loaded yet (or reset by delete), or changed elsewhere: adding
+            # to the cached index would drop every other template
+            stale = self._index is None or self.backend.templates_stamp() != self._stamp
+            self.backend.write_template(name, data)
+            if stale:
+                self._load(self.backend.templates_stamp())
+            else:
+                index = dict(self._index)
+                index[name] = dict(data)
+                self._index = index
+                self._stamp = self.backend.templates_stamp()
+
+    def delete(self, name):
+        with self._lock:
+            removed = self.backend.remove_template(name)
+            self._index = None  # Reload: the file name on disk may differ from name
+        return removed
+
+
+class RoomRegistry:
+    """Every room (voice channel) of this deployment, cached in memory.
+
+    Room ids double as file/row keys (``vc1``, ``vc2``, ...); the display name
+    is free text. The list is re-read from the backend at most once every
+    ``refresh_interval`` seconds so rooms created by another process show up.
+    """
+
+    def __init__(self, backend, refresh_interval=1.0):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self._rooms = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _read(self):
+        rooms = list(DEFAULT_ROOMS)
+        known = {room["id"] for room in rooms}
+        for room in self.backend.room_list():
+            if room["id"] not in known:
+                rooms.append(room)
+                known.add(room["id"])
+        return rooms
+
+    def list(self):
+        """Rooms in creation order, as {"id", "name"} dicts"""
+        # One read of the attribute: create() may reset it at any moment
+        rooms = self._rooms
+        now = time.monotonic()
+        if rooms is None or now - self._loaded_at >= self.refresh_interval:
+            rooms = self._read()
+            self._rooms = rooms
+            self._loaded_at = now
+        return rooms
+
+    def create(self, name):
+        """Register a new room and return its id"""
+        with self._lock:
+            taken = {room["id"] for room in self._read()}
+            n = len(taken) + 1
+            while f"vc{n}" in taken:
+                n += 1
+            room_id = f"vc{n}"
+            self.backend.add_room(room_id, name)
+            self._rooms = None
+        return room_id
+
+
+class SharedStateStore:
+    """One authoritative in-memory state per VC, shared by every session.
+
+    Sessions keep a reference to the store and the version (journal sequence
+    number) they last rendered, so "has anything changed?" is an integer
+    comparison. Writes made by other processes are picked up by polling the
+    backend's version at most once every ``sync_interval`` seconds per VC.
+
+    States are copy-on-write snapshots: a commit or refresh builds a new state
+    and swaps it in with one assignment, so a render keeps reading the state
+    it got from ``get`` while others write. Callers must not modify it.
+    """
+
+    def __init__(self, backend, sync_interval=1.0):
+        self.backend = backend
+        self.sync_interval = sync_interval
+        self._states = {}
+        self._last_sync = {}
+        self._guard = threading.Lock()
+        self._vc_guards = {}
+
+    def _vc_guard(self, vc_id):
+        with self._guard:
+            return self._vc_guards.setdefault(vc_id, threading.RLock())
+
+    @timed("store.get")
+    def get(self, vc_id):
+        """Latest shared state snapshot for a VC, loaded on first access"""
+        state = self._states.get(vc_id)
+        if state is None:
+            with self._vc_guard(vc_id):
+                state = self._states.get(vc_id)
+                if state is None:
+                    state = self.backend.load(vc_id)
+                    self._states[vc_id] = state
+                    self._last_sync[vc_id] = time.monotonic()
+            return state
+        now = time.monotonic()
+        if now - self._last_sync.get(vc_id, 0) >= self.sync_interval:
+            self._last_sync[vc_id] = now
+            with self._vc_guard(vc_id):
+                try:
+                    changed = self.backend.latest_version(vc_id) > state["seq"]
+                except (OSError, ValueError, sqlite3.Error):
+                    changed = False
+                if changed:
+                    state = self.backend.load(vc_id)
+                    self._states[vc_id] = state
+                else:
+                    state = self._states[vc_id]
+        return state
+
+    def version(self, vc_id):
+        """Version of the in-memory state, without touching storage"""
+        state = self._states.get(vc_id)
+        return state["seq"] if state is not None else 0
+
+    @timed("store.commit")
+    def commit(self, vc_id, op, base_version=None):
+        """Apply an operation, persist it and return the new state snapshot.
+
+        Raises ``StateConflict`` when op was based on an outdated view of a
+        field someone else has since changed.
+        """
+        self.get(vc_id)
+        with self._vc_guard(vc_id):
+            try:
+                state = self.backend.commit(vc_id, self._states[vc_id], op, base_version)
+            except StateConflict:
+                # The backend had newer writes: show them on the next render
+                self._states[vc_id] = self.backend.load(vc_id)
+                raise
+            self._states[vc_id] = state
+            return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue storage maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = sub.add_parser("migrate", help="import JSON queues and templates into SQLite")
+    migrate_cmd.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    migrate_cmd.add_argument("--templates", default="templates", help="templates directory")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        rooms, names = migrate(args.db, args.templates)
+        print(f"Imported {len(rooms)} VC(s) and {len(names)} template(s) into {args.db}")
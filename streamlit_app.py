@@ -1,15 +1,24 @@
 import streamlit as st
-import streamlit_sortables as sortables
-import json, os, io, base64
-from PIL import Image, ImageDraw, ImageFont
-from streamlit_autorefresh import st_autorefresh
-from datetime import datetime
-import requests
-import time
+import copy
+import json, os
 import random
+import threading
+import time
 import html  # Added for HTML sanitization
 from streamlit import fragment
 import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
+import discord_output
+import up_next
+from custom_components import reaction_overlay, youtube_player
+from catalog import DEFAULT_CATALOG, load_catalog
+import profiling
+import recorder
+from profiling import section, timed
+from queue_state import StateConflict
+from role_matching import fair_assignment
+from roster import find_move
+from storage import RoomRegistry, SharedStateStore, TemplateCatalog, open_backend
 
 # ==========================================================
 # 🖥️ DESKTOP FULL-WIDTH / WIDE LAYOUT CONFIGURATION
@@ -22,132 +31,33 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# ========== EPIC THE MUSICAL SONG DATA ==========
-EPIC_SONGS = {
-    "The Horse and the Infant": ["Odysseus", "Zeus", "Soldiers", "Infant Astyanax"],
-    "Just a Man": ["Odysseus", "Zeus", "Ensemble"],
-    "Full Speed Ahead": ["Odysseus", "Eurylochus", "Polites", "Crew"],
-    "Open Arms": ["Polites", "Odysseus", "Lotus Eaters"],
-    "Warrior of the Mind": ["Athena", "Young Odysseus", "Ensemble"],
-    "Polyphemus": ["Odysseus", "Polyphemus", "Eurylochus", "Crew"],
-    "Survive": ["Odysseus", "Polyphemus", "Crew"],
-    "Remember Them": ["Odysseus", "Athena", "Polyphemus", "Crew"],
-    "My Goodbye": ["Athena", "Odysseus"],
-    "Storm": ["Odysseus", "Crew", "Poseidon"],
-    "Luck Runs Out": ["Eurylochus", "Odysseus", "Crew"],
-    "Keep Your Friends Close": ["Aeolus", "Odysseus", "Winions", "Crew"],
-    "Ruthlessness": ["Poseidon", "Odysseus", "Crew"],
-    "Puppeteer": ["Circe", "Odysseus", "Enchanted Crew"],
-    "Wouldn't You Like": ["Hermes", "Odysseus"],
-    "Done For": ["Circe", "Odysseus"],
-    "There Are Other Ways": ["Circe", "Odysseus"],
-    "The Underworld": ["Odysseus", "Dead Souls", "Anticlea", "Prophet Spirits"],
-    "No Longer You": ["Tiresias", "Odysseus"],
-    "Monster": ["Odysseus", "Ensemble"],
-    "Suffering": ["Siren Penelope", "Odysseus", "Sirens"],
-    "Different Beast": ["Odysseus", "Crew", "Sirens"],
-    "Scylla": ["Odysseus", "Scylla", "Crew"],
-    "Mutiny": ["Eurylochus", "Odysseus", "Crew"],
-    "Thunder Bringer": ["Zeus", "Odysseus", "Crew"],
-    "Legendary": ["Telemachus", "Suitors", "Ensemble"],
-    "Little Wolf": ["Athena", "Telemachus", "Antinous"],
-    "We'll Be Fine": ["Athena", "Telemachus"],
-    "Love in Paradise": ["Calypso", "Odysseus"],
-    "God Games": ["Athena", "Zeus", "Hera", "Aphrodite", "Ares", "Apollo", "Hephaestus"],
-    "Not Sorry for Loving You": ["Calypso", "Odysseus"],
-    "Dangerous": ["Hermes", "Odysseus"],
-    "Charybdis": ["Odysseus", "Charybdis"],
-    "Get in the Water": ["Poseidon", "Odysseus"],
-    "Six Hundred Strike": ["Odysseus", "Poseidon", "Crew Spirits"],
-    "The Challenge": ["Penelope", "Suitors", "Telemachus"],
-    "Hold Them Down": ["Antinous", "Suitors"],
-    "Odysseus": ["Odysseus", "Suitors", "Telemachus"],
-    "I Can't Help but Wonder": ["Odysseus", "Telemachus"],
-    "Would You Fall in Love with Me Again": ["Odysseus", "Penelope"],
-    "Olive Tree": ["Odysseus", "Penelope"],
-    "Your LIght": ["Odysseus", "Polites"],
-    "In Vain": ["Posseidon"]
-}
+# ========== SONG CATALOG ==========
+SONG_CATALOG = os.environ.get("SONG_CATALOG", DEFAULT_CATALOG)  # File name in catalogs/ without .json
 
-KARAOKE_SONGS = [
-    {"title": "The Horse and the Infant", "url": "https://www.youtube.com/watch?v=s9yC83t-43U"},
-    {"title": "Just a Man", "url": "https://www.youtube.com/watch?v=ZB7vfy7V1FY"},
-    {"title": "Full Speed Ahead", "url": "https://www.youtube.com/watch?v=jzC7_dEzGG8"},
-    {"title": "Open Arms", "url": "https://www.youtube.com/watch?v=a7Frzd7qKys"},
-    {"title": "Warrior of the Mind", "url": "https://www.youtube.com/watch?v=yTacPhQxgBc"},
-    {"title": "Polyphemus", "url": "https://www.youtube.com/watch?v=C5GjdJjYk5c"},
-    {"title": "Survive", "url": "https://www.youtube.com/watch?v=y6kpHkHomEE"},
-    {"title": "Remember Them", "url": "https://www.youtube.com/watch?v=qZitYcJ3IJs"},
-    {"title": "My Goodbye", "url": "https://www.youtube.com/watch?v=LgeyfqM7ocQ"},
-    {"title": "Storm", "url": "https://www.youtube.com/watch?v=bmNG2wtP5xE"},
-    {"title": "Luck Runs Out", "url": "https://www.youtube.com/watch?v=OtPkiKJ7xv4"},
-    {"title": "Keep Your Friends Close", "url": "https://www.youtube.com/watch?v=Im-A6to8p70"},
-    {"title": "Ruthlessness", "url": "https://www.youtube.com/watch?v=Q2sZySb1oyI"},
-    {"title": "Puppeteer", "url": "https://www.youtube.com/watch?v=D-JXTkOX3qc"},
-    {"title": "Wouldn't You Like", "url": "https://www.youtube.com/watch?v=CEinc00Hq4o"},
-    {"title": "Done For", "url": "https://www.youtube.com/watch?v=l-PHdYz_GKI"},
-    {"title": "There Are Other Ways", "url": "https://www.youtube.com/watch?v=CqlKbM2Bkyc"},
-    {"title": "The Underworld", "url": "https://www.youtube.com/watch?v=1AiCyMCnerw"},
-    {"title": "No Longer You", "url": "https://www.youtube.com/watch?v=54ubVuVJD7Y"},
-    {"title": "Monster", "url": "https://www.youtube.com/watch?v=5xEbWoPh-aU"},
-    {"title": "Suffering", "url": "https://www.youtube.com/watch?v=HvnMShpTeYY"},
-    {"title": "Different Beast", "url": "https://www.youtube.com/watch?v=BnLkgJKEelI"},
-    {"title": "Scylla", "url": "https://www.youtube.com/watch?v=-ZaYvNJ_nvY"},
-    {"title": "Mutiny", "url": "https://www.youtube.com/watch?v=dFenHkaoyck"},
-    {"title": "Thunder Bringer", "url": "https://www.youtube.com/watch?v=1AytyN8tHXA"},
-    {"title": "Legendary", "url": "https://www.youtube.com/watch?v=fKFqyr5Z1GY"},
-    {"title": "Little Wolf", "url": "https://www.youtube.com/watch?v=St0T0D3ArvY"},
-    {"title": "We'll Be Fine", "url": "https://www.youtube.com/watch?v=ogBM4tCu7Lc"},
-    {"title": "Love in Paradise", "url": "https://www.youtube.com/watch?v=wzwdfdB7fI8"},
-    {"title": "God Games", "url": "https://www.youtube.com/watch?v=iYSgqR_STUE"},
-    {"title": "Not Sorry for Loving You", "url": "https://www.youtube.com/watch?v=GFo4rNvfEgE"},
-    {"title": "Dangerous", "url": "https://www.youtube.com/watch?v=5Vl-hHDu23M"},
-    {"title": "Charybdis", "url": "https://www.youtube.com/watch?v=bHM8pjotMWw"},
-    {"title": "Get in the Water", "url": "https://www.youtube.com/watch?v=0QkUmui4_Uw"},
-    {"title": "Six Hundred Strike", "url": "https://www.youtube.com/watch?v=5i2U38ISj1c"},
-    {"title": "The Challenge", "url": "https://www.youtube.com/watch?v=I-KlhO46puk"},
-    {"title": "Hold Them Down", "url": "https://www.youtube.com/watch?v=LOgbDbrv2Q4"},
-    {"title": "Odysseus", "url": "https://www.youtube.com/watch?v=S4C55xJmMDc"},
-    {"title": "I Can't Help but Wonder", "url": "https://www.youtube.com/watch?v=v6qVpnoyLuk"},
-    {"title": "Would You Fall in Love with Me Again", "url": "https://www.youtube.com/watch?v=GEyvmZqOv0g"},
-    {"title": "Olive Tree", "url": "https://www.youtube.com/watch?v=xDG5VKScZDY"},  
-    {"title": "Your Light", "url": "https://www.youtube.com/watch?v=JxpKzQqT5YM"},
-    {"title": "In Vain", "url": "https://www.youtube.com/watch?v=_28-ZLNxoPU"}    
-]
+@st.cache_resource
+def get_catalog(catalog_id=SONG_CATALOG):
+    """Songs, roles and role icons of a musical, loaded once per process"""
+    return load_catalog(catalog_id)
+
+song_catalog = get_catalog()
+EPIC_SONGS = song_catalog.roles
 
 def find_best_karaoke_match(query):
     """Find best matching karaoke song using fuzzy token matching."""
-    if not query:
-        return None
-    query_lower = query.lower()
-    best_match = None
-    best_score = 0
-    for song in KARAOKE_SONGS:
-        title_lower = song["title"].lower()
-        if query_lower in title_lower:
-            score = len(query_lower) / len(title_lower) * 100 + 50
-        else:
-            q_tokens = set(query_lower.split())
-            t_tokens = set(title_lower.split())
-            overlap = q_tokens & t_tokens
-            score = len(overlap) / max(len(q_tokens), 1) * 100
-        if score > best_score:
-            best_score = score
-            best_match = song
-    return best_match if best_score > 0 else None
-
-def get_youtube_embed_url(yt_url):
-    """Convert YouTube watch URL to embed URL."""
+    return song_catalog.index.best(query)
+
+def get_youtube_video_id(yt_url):
+    """Video id from a YouTube watch or embed URL."""
     if "watch?v=" in yt_url:
-        vid_id = yt_url.split("watch?v=")[1].split("&")[0]
-        return f"https://www.youtube.com/embed/{vid_id}"
-    return yt_url
+        return yt_url.split("watch?v=")[1].split("&")[0]
+    return yt_url.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
 
 SAVE_FILE = "queue.json"
 TEMPLATES_DIR = "templates"
 ADMIN_PASSCODE = "531246"
 ROLE_EDIT_PASSCODE = "010203"
 SYNC_CHECK_INTERVAL = 1  # Check for updates every 1 second
+STORAGE_BACKEND = os.environ.get("QUEUE_STORAGE", "json")  # "json", "sqlite" or "sqlite:<path>"
 
 # Symbol options for role icons in the Role Assignment editor
 ROLE_SYMBOL_OPTIONS = {
@@ -169,8 +79,31 @@ ROLE_SYMBOL_OPTIONS = {
     "🏹 Bow": "🏹",
 }
 
-if not os.path.exists(TEMPLATES_DIR):
-    os.makedirs(TEMPLATES_DIR)
+@st.cache_resource
+def get_storage():
+    """Storage backend for queue state and templates (see STORAGE_BACKEND)"""
+    return open_backend(STORAGE_BACKEND, templates_dir=TEMPLATES_DIR)
+
+@st.cache_resource
+def get_state_store():
+    """Single in-process copy of every VC's state, shared by all sessions"""
+    return SharedStateStore(get_storage(), sync_interval=SYNC_CHECK_INTERVAL)
+
+@st.cache_resource
+def get_template_catalog():
+    """Templates indexed in memory, reloaded only when storage changes"""
+    return TemplateCatalog(get_storage(), refresh_interval=SYNC_CHECK_INTERVAL)
+
+@st.cache_resource
+def get_analytics():
+    """Columnar log of who sang what, shared by all sessions"""
+    from analytics import AnalyticsLog  # numpy: only needed once someone advances or opens the stats
+    return AnalyticsLog()
+
+@st.cache_resource
+def get_room_registry():
+    """All rooms (voice channels); their state is only loaded when opened"""
+    return RoomRegistry(get_storage(), refresh_interval=SYNC_CHECK_INTERVAL)
 
 DEFAULT_TEMPLATE = {
     "name": "Default EPIC",
@@ -188,103 +121,23 @@ DEFAULT_TEMPLATE = {
     "wheel_link": "<https://wheelofnames.com/jr7-eaa>"
 }
 
-def load_state(vc_id):
-    """Load state for specific VC (vc1 or vc2)"""
-    save_file = f"queue_{vc_id}.json"
-    if os.path.exists(save_file):
-        with open(save_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return {
-            "queue": data.get("queue", []),
-            "calypso": data.get("calypso", []),
-            "pinged": set(data.get("pinged", [])),
-            "current_manager": data.get("current_manager", ""),
-            "current_template": data.get("current_template", "Default EPIC"),
-            "last_modified": data.get("last_modified", 0),
-            "selected_song": data.get("selected_song", ""),
-            "role_assignments": data.get("role_assignments", {}),
-            "custom_roles": data.get("custom_roles", {}),
-            "custom_reactions": data.get("custom_reactions", {}),
-        }
-    return {
-        "queue": [],
-        "calypso": [],
-        "pinged": set(),
-        "current_manager": "",
-        "current_template": "Default EPIC",
-        "last_modified": time.time(),
-        "selected_song": "",
-        "role_assignments": {},
-        "custom_roles": {},
-        "custom_reactions": {},
-    }
-
-def save_state(vc_id, state):
-    """Save state for specific VC"""
-    save_file = f"queue_{vc_id}.json"
-    data = {
-        "queue": state["queue"],
-        "calypso": state["calypso"],
-        "pinged": list(state["pinged"]),
-        "current_manager": state["current_manager"],
-        "current_template": state["current_template"],
-        "last_modified": time.time(),
-        "selected_song": state.get("selected_song", ""),
-        "role_assignments": state.get("role_assignments", {}),
-        "custom_roles": state.get("custom_roles", {}),
-        "custom_reactions": state.get("custom_reactions", {}),
-    }
-    with open(save_file, "w", encoding="utf-8") as f:
-        json.dump(data, f)
-
-def check_for_updates(vc_id, current_last_modified):
-    """Check if file has been modified by another user"""
-    save_file = f"queue_{vc_id}.json"
-    if os.path.exists(save_file):
-        try:
-            with open(save_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            last_modified = data.get("last_modified", 0)
-            return last_modified > current_last_modified
-        except:
-            return False
-    return False
-
 def load_template(template_name):
     """Load template from file or return default"""
     if template_name == "Default EPIC":
         return DEFAULT_TEMPLATE.copy()
     
-    template_file = os.path.join(TEMPLATES_DIR, f"{template_name}.json")
-    if os.path.exists(template_file):
-        with open(template_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+    template = get_template_catalog().get(template_name)
+    if template is not None:
+        return template
     return DEFAULT_TEMPLATE.copy()
 
 def save_template(template_name, template_data):
-    """Save template to file"""
-    template_file = os.path.join(TEMPLATES_DIR, f"{template_name}.json")
-    with open(template_file, "w", encoding="utf-8") as f:
-        json.dump(template_data, f, indent=2)
+    """Save template to storage"""
+    get_template_catalog().save(template_name, template_data)
 
 def delete_template(template_name):
-    # Strip out any directory traversal attempts like ../ or ..\
-    clean_name = os.path.basename(template_name)
-    
-    # Alternatively, ensure it only points to a literal filename
-    file_path = os.path.join(TEMPLATES_DIR, f"{clean_name}.json")
-    
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return True
-        else:
-            # If it still fails, check if the file literal name on disk is exactly the broken string
-            fallback_path = os.path.join(TEMPLATES_DIR, f"{template_name}.json")
-            if os.path.exists(fallback_path):
-                os.remove(fallback_path)
-                return True
-            return False
+        return get_template_catalog().delete(template_name)
     except Exception as e:
         st.error(f"Error removing file: {e}")
         return False
@@ -294,66 +147,210 @@ def get_available_templates():
     templates = ["Default EPIC"]
     seen = {"Default EPIC"} # Track what we've already added
     
-    if os.path.exists(TEMPLATES_DIR):
-        for file in os.listdir(TEMPLATES_DIR):
-            if file.endswith(".json"):
-                name = file.replace(".json", "")
-                if name not in seen:
-                    templates.append(name)
-                    seen.add(name)
+    for name in get_template_catalog().names():
+        if name not in seen:
+            templates.append(name)
+            seen.add(name)
     return templates
 
 # Initialize session state
 if "initialized" not in st.session_state:
     st.session_state.initialized = True
     st.session_state.current_vc = "vc1"
-    st.session_state.vc1_data = load_state("vc1")
-    st.session_state.vc2_data = load_state("vc2")
     st.session_state.rev = 0
-    st.session_state.current_user_vc1 = ""
-    st.session_state.current_user_vc2 = ""
     st.session_state.show_manager_confirm = False
     st.session_state.manager_candidate = ""
     st.session_state.admin_authenticated = False
     for flag in ["show_leave", "show_hold", "show_return", "show_ping"]:
         st.session_state[flag] = False
-    st.session_state.vc1_role_history = []
-    st.session_state.vc2_role_history = []
 
-# Auto-refresh for non-managers
-is_manager_vc1 = st.session_state.current_user_vc1 == st.session_state.vc1_data["current_manager"]
-is_manager_vc2 = st.session_state.current_user_vc2 == st.session_state.vc2_data["current_manager"]
+state_store = get_state_store()
+room_registry = get_room_registry()
+
+@st.cache_resource
+def warm_up():
+    """Build the song index, compile templates and import optional modules once per process, off the render path"""
+    templates = get_template_catalog()
+
+    def preload():
+        song_catalog.index.best("warm up")
+        for template in [DEFAULT_TEMPLATE] + [templates.get(name) for name in templates.names()]:
+            if template is not None:
+                discord_output.compile_template(template)
+        import analytics, streamlit_sortables  # noqa: F401  (numpy and the sortable component)
+
+    thread = threading.Thread(target=preload, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+warm_up()
 
 
 st.markdown("<h1 style='text-align: center; font-weight: 700; margin-bottom: 1rem;'>EPIC KARAOKE MANAGER</h1>", unsafe_allow_html=True)
 
 # ========== MAIN NAVIGATION ==========
+room_tabs = {}
+for room in room_registry.list():
+    label = f"🎵 {room['name']}"
+    if label in room_tabs:
+        label = f"🎵 {room['name']} ({room['id']})"
+    room_tabs[label] = room["id"]
+
 selected_tab = st.segmented_control(
     "Select Section - Must use the dark theme from the top right triple dot setting !, use F11 for fullscreen",
-    ["🎵 VC 1", "🎵 VC 2", "✨ Customize"],
+    list(room_tabs) + ["✨ Customize"],
     default=st.session_state.get("main_selected_tab"),
     key="main_selected_tab"
 )
 
+SPIN_STEPS_MS = [50]*10 + [100]*5 + [200]*3 + [400]*1
+WAR_COUNTDOWN_SECONDS = 5
+
+def _js_value(value):
+    """Embed a Python value in an inline <script> safely"""
+    return json.dumps(value).replace("</", "<\\/")
+
+def spin_animation_script(reel, winner):
+    """Browser-side slot-machine reel that stops on the already chosen winner"""
+    return f"""<script>
+(function() {{
+  var doc = window.parent.document;
+  var REEL = {_js_value(reel)}, STEPS = {_js_value(SPIN_STEPS_MS)}, WINNER = {_js_value(winner)};
+  var old = doc.getElementById('__spin_overlay'); if (old) old.remove();
+  var box = doc.createElement('div');
+  box.id = '__spin_overlay';
+  box.style.cssText = 'position:fixed;top:30%;left:50%;transform:translate(-50%,-50%);z-index:2147483646;' +
+    'text-align:center;padding:14px 28px;background:#1e1e24;border:2px solid #ffaa00;border-radius:8px;' +
+    'font-family:sans-serif;pointer-events:none;box-shadow:0 0 30px rgba(255,170,0,0.5);';
+  var head = doc.createElement('h3');
+  head.style.cssText = 'color:#ffaa00;margin:0;';
+  head.textContent = '🎰 Spinning... 🎰';
+  var line = doc.createElement('p');
+  line.style.cssText = 'font-size:1.4rem;color:white;margin:5px 0 0 0;font-weight:700;';
+  box.appendChild(head); box.appendChild(line); doc.body.appendChild(box);
+  var i = 0;
+  function step() {{
+    if (i < REEL.length) {{
+      line.textContent = '✨ ' + REEL[i] + ' ✨';
+      setTimeout(step, STEPS[i++]);
+    }} else {{
+      head.textContent = '🎯 Landed on:';
+      line.textContent = '✨ ' + WINNER + ' ✨';
+      setTimeout(function() {{ box.remove(); }}, 2000);
+    }}
+  }}
+  step();
+}})();
+</script>"""
+
+def war_animation_script(role, gif_url, winner):
+    """Browser-side role-war countdown that reveals the already chosen winner"""
+    return f"""<script>
+(function() {{
+  var doc = window.parent.document;
+  var ROLE = {_js_value(role.upper())}, GIF = {_js_value(gif_url)}, WINNER = {_js_value(winner)};
+  var old = doc.getElementById('__war_overlay'); if (old) old.remove();
+  var box = doc.createElement('div');
+  box.id = '__war_overlay';
+  box.style.cssText = 'position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);z-index:2147483646;' +
+    'text-align:center;padding:8px;background-color:#0c0c0c;border:2px dashed #ff4b4b;border-radius:8px;' +
+    'font-family:sans-serif;pointer-events:none;width:min(500px,90vw);';
+  var head = doc.createElement('h4');
+  head.style.cssText = 'color:#ff4b4b;margin:0;font-size:1.1rem;text-shadow:0 0 5px #ff0000;';
+  head.textContent = '🔥 ROLE WAR FOR ' + ROLE + '! 🔥';
+  var line = doc.createElement('p');
+  line.style.cssText = 'font-size:0.95rem;font-weight:bold;color:white;margin:4px 0;';
+  var img = doc.createElement('img');
+  img.src = GIF;
+  img.style.cssText = 'width:100%;max-width:470px;border-radius:6px;border:1.5px solid #fff;';
+  box.appendChild(head); box.appendChild(line); box.appendChild(img); doc.body.appendChild(box);
+  var left = {WAR_COUNTDOWN_SECONDS};
+  function tick() {{
+    if (left > 0) {{
+      line.textContent = 'Clashing finishes in ' + left + '...';
+      left--;
+      setTimeout(tick, 1000);
+    }} else {{
+      img.remove();
+      line.style.fontSize = '1.3rem';
+      line.textContent = '🏆 ' + WINNER + ' won the fight for ' + ROLE + '!';
+      setTimeout(function() {{ box.remove(); }}, 2500);
+    }}
+  }}
+  tick();
+}})();
+</script>"""
+
+def rerun_fragment():
+    """Rerun only the current fragment, or the whole app during a full run"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@fragment(run_every=SYNC_CHECK_INTERVAL)
+@timed("vc.up_next")
+def render_up_next(vc_id):
+    """Up Next cards, kept live for viewers without rerunning the whole page"""
+    panel_html = up_next.panel(vc_id, state_store.get(vc_id))
+    if panel_html:
+        st.html(panel_html)
+    else:
+        st.markdown('<div style="color:#666;font-size:0.85rem;text-align:center;padding:16px 0;">Queue is empty</div>', unsafe_allow_html=True)
+
+@fragment(run_every=SYNC_CHECK_INTERVAL)
+@timed("vc.discord_output")
+def render_discord_output(vc_id):
+    """Discord output block, rebuilt only when the state or template changed"""
+    vc_data = state_store.get(vc_id)
+    current_template = load_template(vc_data["current_template"])
+    st.code(discord_output.render_cached(vc_id, current_template, vc_data), language="text")
+
+def trace_session():
+    """Anonymous token telling this session apart in recorded traces"""
+    return st.session_state.setdefault("trace_session", f"{random.getrandbits(32):08x}")
+
+@timed("vc.render")
 def render_vc_content(vc_id):
     """Render queue content for a specific VC"""
     
-    if vc_id == "vc1":
-        vc_data = st.session_state.vc1_data
-        current_user_key = "current_user_vc1"
-    else:
-        vc_data = st.session_state.vc2_data
-        current_user_key = "current_user_vc2"
-    
-    if check_for_updates(vc_id, vc_data["last_modified"]):
-        updated_data = load_state(vc_id)
-        if vc_id == "vc1":
-            st.session_state.vc1_data = updated_data
-            vc_data = updated_data
-        else:
-            st.session_state.vc2_data = updated_data
-            vc_data = updated_data
-        st.rerun()
+    current_user_key = f"current_user_{vc_id}"
+    st.session_state.setdefault(current_user_key, "")
+
+    # Shared state is always the latest version; the session only remembers which
+    # version it last showed, so edits made from an older view can be detected
+    with section("vc.sync"):
+        vc_data = state_store.get(vc_id)
+    version_key = f"{vc_id}_rendered_version"
+    render_version = state_store.version(vc_id)
+    st.session_state.setdefault(version_key, render_version)
+    if recorder.recording():
+        recorder.record_render(trace_session(), vc_id, vc_data)
+
+    def commit_action(op):
+        """Commit an action against the version this session last showed"""
+        nonlocal vc_data
+        if recorder.recording():
+            recorder.record_op(trace_session(), vc_id, op, state_store.version(vc_id) - st.session_state[version_key], vc_data)
+        try:
+            vc_data = state_store.commit(vc_id, op, base_version=st.session_state[version_key])
+        except StateConflict as conflict:
+            st.session_state[version_key] = state_store.version(vc_id)
+            st.toast(f"⚠️ Someone else just changed {', '.join(conflict.fields)}. Please try again.")
+            st.rerun()
+        st.session_state[version_key] = state_store.version(vc_id)
+
+    def refresh():
+        """Fragments rerun on their own: read the latest state snapshot again"""
+        nonlocal vc_data
+        vc_data = state_store.get(vc_id)
+        # The fragment now shows this version, so its next action is based on it
+        st.session_state[version_key] = max(st.session_state[version_key], vc_data["seq"])
+
+    rename = song_catalog.rename_op(vc_id, vc_data)
+    if rename:
+        # Saved before a song or role was renamed in the catalog file
+        commit_action(rename)
     
     active_song = vc_data.get("selected_song", "")
     
@@ -375,13 +372,8 @@ def render_vc_content(vc_id):
 
     def really_claim_manager(name):
         name = name[:20] # Safeguard truncation
-        vc_data["current_manager"] = name
-        save_state(vc_id, vc_data)
+        commit_action({"op": "set", "fields": {"current_manager": name}})
         st.session_state[current_user_key] = name
-        if vc_id == "vc1":
-            st.session_state.vc1_data = vc_data
-        else:
-            st.session_state.vc2_data = vc_data
         st.success("You are now managing the queue.")
         st.session_state.show_manager_confirm = False
         st.session_state.manager_candidate = ""
@@ -406,13 +398,8 @@ def render_vc_content(vc_id):
     with claim_cols[2]:
         if st.session_state[current_user_key] == vc_data["current_manager"] and vc_data["current_manager"]:
             if st.button("🔓 Release", use_container_width=True, key=f"{vc_id}_release_btn"):
-                vc_data["current_manager"] = ""
                 st.session_state[current_user_key] = ""
-                save_state(vc_id, vc_data)
-                if vc_id == "vc1":
-                    st.session_state.vc1_data = vc_data
-                else:
-                    st.session_state.vc2_data = vc_data
+                commit_action({"op": "set", "fields": {"current_manager": ""}})
                 st.success("You have released manage rights.")
                 st.rerun()
 
@@ -431,16 +418,16 @@ def render_vc_content(vc_id):
     st.markdown("---")
     
     yt_search_key = f"{vc_id}_yt_search"
-    yt_url_key = f"{vc_id}_yt_current_url"
+    yt_video_key = f"{vc_id}_yt_current_video"
     yt_title_key = f"{vc_id}_yt_current_title"
-    if yt_url_key not in st.session_state:
-        st.session_state[yt_url_key] = ""
+    if yt_video_key not in st.session_state:
+        st.session_state[yt_video_key] = ""
         st.session_state[yt_title_key] = ""
 
     def set_yt_from_song_title(song_title):
         match = find_best_karaoke_match(song_title)
         if match:
-            st.session_state[yt_url_key] = get_youtube_embed_url(match["url"])
+            st.session_state[yt_video_key] = get_youtube_video_id(match["url"])
             st.session_state[yt_title_key] = match["title"]
 
     def handle_yt_search():
@@ -448,17 +435,11 @@ def render_vc_content(vc_id):
         if query:
             match = find_best_karaoke_match(query)
             if match:
-                st.session_state[yt_url_key] = get_youtube_embed_url(match["url"])
+                st.session_state[yt_video_key] = get_youtube_video_id(match["url"])
                 st.session_state[yt_title_key] = match["title"]
                 matched_title = match["title"]
                 if matched_title in EPIC_SONGS:
-                    vc_data["selected_song"] = matched_title
-                    vc_data["role_assignments"] = {}
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
+                    commit_action({"op": "set", "fields": {"selected_song": matched_title, "role_assignments": {}}})
                     st.session_state[f"{vc_id}_song_select"] = matched_title
             else:
                 st.session_state[yt_title_key] = "No match found"
@@ -467,54 +448,40 @@ def render_vc_content(vc_id):
     if active_song and st.session_state.get(yt_title_key) != active_song:
         set_yt_from_song_title(active_song)
 
-    yt_col, dummy_col, actions_col = st.columns([3, 0.1, 1])
-    
-    with yt_col:
+    react_edit_toggle_key = f"{vc_id}_reaction_edit_toggle"
+
+    @fragment
+    @timed("vc.player_controls")
+    def player_controls():
+        """Song selector, spin and now-playing caption"""
+        refresh()
         # ---- Song selector + Spin (moved here from Role Assignment panel) ----
         _song_list_yt = list(EPIC_SONGS.keys())
         _songs_with_none_yt = ["— Select a song —"] + _song_list_yt
         _is_manager_yt = st.session_state[current_user_key] == vc_data["current_manager"]
     
-        # Handle spin triggered from this area
+        # Handle spin triggered from this area: the winner is picked right away and
+        # the reel is played by the browser, so this thread is never put to sleep
         _spin_triggered_yt = False
         if _is_manager_yt and st.session_state.get(f"{vc_id}_spin_btn"):
-            _spinner_ph = st.empty()
-            _spin_durations = [0.05]*10 + [0.1]*5 + [0.2]*3 + [0.4]*1
-            for _dur in _spin_durations:
-                _temp = random.choice(_song_list_yt)
-                _spinner_ph.markdown(
-                    f'<div style="text-align:center;padding:10px;background:#1e1e24;border:2px solid #ffaa00;border-radius:8px;">'
-                    f'<h3 style="color:#ffaa00;margin:0;">🎰 Spinning... 🎰</h3>'
-                    f'<p style="font-size:1.2rem;color:white;margin:5px 0 0 0;">✨ <b>{html.escape(_temp)}</b> ✨</p></div>',
-                    unsafe_allow_html=True
-                )
-                time.sleep(_dur)
             _winning = random.choice(_song_list_yt)
-            _spinner_ph.empty()
-            history_key_yt = f"{vc_id}_role_history"
-            st.session_state[history_key_yt].append({
-                "selected_song": vc_data.get("selected_song", ""),
-                "role_assignments": dict(vc_data.get("role_assignments", {}))
-            })
-            vc_data["selected_song"] = _winning
-            vc_data["role_assignments"] = {}
-            active_song = _winning
-            save_state(vc_id, vc_data)
-            if vc_id == "vc1":
-                st.session_state.vc1_data = vc_data
-            else:
-                st.session_state.vc2_data = vc_data
+            _reel = [random.choice(_song_list_yt) for _ in SPIN_STEPS_MS]
+            st.session_state[f"{vc_id}_spin_animation"] = spin_animation_script(_reel, _winning)
+            commit_action({"op": "set", "fields": {"selected_song": _winning, "role_assignments": {}}})
             st.session_state[f"{vc_id}_song_select"] = _winning
             _yt_match = find_best_karaoke_match(_winning)
             if _yt_match:
-                st.session_state[yt_url_key] = get_youtube_embed_url(_yt_match["url"])
+                st.session_state[yt_video_key] = get_youtube_video_id(_yt_match["url"])
                 st.session_state[yt_title_key] = _yt_match["title"]
-            st.toast(f"🎯 Landed on: {_winning}!")
             _spin_triggered_yt = True
     
         _current_song_yt = vc_data.get("selected_song", "")
         _default_idx_yt = _songs_with_none_yt.index(_current_song_yt) if _current_song_yt in _songs_with_none_yt else 0
     
+        _pending_song = st.session_state.pop(f"{vc_id}_song_select_pending", None)
+        if _pending_song is not None:
+            st.session_state[f"{vc_id}_song_select"] = _pending_song
+
         # NEW LAYOUT: Song selector (smaller) + Spin + Reaction edit button
         _song_spin_cols = st.columns([2.5, 1, 1])  # Reduced song field from 5 to 2.5
         with _song_spin_cols[0]:
@@ -530,40 +497,35 @@ def render_vc_content(vc_id):
             st.button("🎰 Spin!", key=f"{vc_id}_spin_btn", disabled=not _is_manager_yt, use_container_width=True)
         
         with _song_spin_cols[2]:
-            react_edit_toggle_key = f"{vc_id}_reaction_edit_toggle"
             if st.button("✏️", key=f"{vc_id}_reaction_edit_btn", help="Edit reaction texts", use_container_width=True):
                 st.session_state[react_edit_toggle_key] = not st.session_state.get(react_edit_toggle_key, False)
+                st.rerun()  # The editor lives in the reactions fragment
     
         # Handle manual song selection
         if _is_manager_yt and not _spin_triggered_yt and _chosen_song_yt != "— Select a song —" and _chosen_song_yt != _current_song_yt:
-            _hist_key = f"{vc_id}_role_history"
-            st.session_state[_hist_key].append({
-                "selected_song": vc_data.get("selected_song", ""),
-                "role_assignments": dict(vc_data.get("role_assignments", {}))
-            })
-            vc_data["selected_song"] = _chosen_song_yt
-            vc_data["role_assignments"] = {}
-            active_song = _chosen_song_yt
             _yt_match2 = find_best_karaoke_match(_chosen_song_yt)
             if _yt_match2:
-                st.session_state[yt_url_key] = get_youtube_embed_url(_yt_match2["url"])
+                st.session_state[yt_video_key] = get_youtube_video_id(_yt_match2["url"])
                 st.session_state[yt_title_key] = _yt_match2["title"]
-            save_state(vc_id, vc_data)
-            if vc_id == "vc1":
-                st.session_state.vc1_data = vc_data
-            else:
-                st.session_state.vc2_data = vc_data
-            st.session_state[f"{vc_id}_auto_reaction"] = True
-            st.rerun()
+            commit_action({"op": "set", "fields": {"selected_song": _chosen_song_yt, "role_assignments": {}}})
+            st.rerun()  # The player lives outside this fragment
     
         if _spin_triggered_yt:
-            st.session_state[f"{vc_id}_auto_reaction"] = True
             st.balloons()
             st.rerun()
     
         if st.session_state[yt_title_key]:
             st.caption(f"🎤 Now playing: **{html.escape(st.session_state[yt_title_key])}**")
-    
+
+        # Effect placeholders (spin, fireworks, war) are always rendered, empty when idle, so the elements below keep their position
+        with section("vc.components.spin"):
+            components.html(st.session_state.pop(f"{vc_id}_spin_animation", ""), height=0)
+
+    @fragment
+    @timed("vc.reactions_panel")
+    def reactions_panel():
+        """Reaction buttons, their text editor and the fireworks overlay"""
+        refresh()
         # ---- REACTION BUTTONS ----
         DEFAULT_REACTIONS = [
             ("🔥", "LEGENDARY", ["#FFD700","#FFA500","#FF8C00","#FFEC8B","#FF6600"]),
@@ -603,28 +565,16 @@ def render_vc_content(vc_id):
                 edit_save_col, edit_close_col = st.columns(2)
                 with edit_save_col:
                     if st.button("💾 Save", key=f"{vc_id}_reaction_save", use_container_width=True):
-                        vc_data["custom_reactions"] = new_custom_reactions
-                        save_state(vc_id, vc_data)
-                        if vc_id == "vc1":
-                            st.session_state.vc1_data = vc_data
-                        else:
-                            st.session_state.vc2_data = vc_data
+                        commit_action({"op": "set", "fields": {"custom_reactions": new_custom_reactions}})
                         st.session_state[react_edit_toggle_key] = False
-                        st.rerun()
+                        rerun_fragment()
                 with edit_close_col:
                     if st.button("✖️ Cancel", key=f"{vc_id}_reaction_cancel", use_container_width=True):
                         st.session_state[react_edit_toggle_key] = False
-                        st.rerun()
-
+                        rerun_fragment()
 
-        # Auto-trigger a silent random reaction after song change to consume the forced iframe reload
-        if st.session_state.pop(f"{vc_id}_auto_reaction", False):
-            _auto = random.choice(REACTIONS)
-            reaction_triggered = _auto[1]
-            reaction_colors = _auto[2]
-        else:
-            reaction_triggered = None
-            reaction_colors = None
+        reaction_triggered = None
+        reaction_colors = None
 
         rcols = st.columns(len(REACTIONS))
         for idx, (emoji, word, _colors) in enumerate(REACTIONS):
@@ -633,147 +583,35 @@ def render_vc_content(vc_id):
                     reaction_triggered = word
                     reaction_colors = _colors
 
-        # Inject fireworks into the MAIN page via components.html + window.parent
-        # No st.rerun() — we fire immediately in the same render pass so the iframe is never rebuilt
+        # The overlay component stays mounted; a reaction only sends it a small event
+        reaction_event = None
         if reaction_triggered:
-            _colors_js = str(reaction_colors)
-            _word_js = reaction_triggered
-            # --- FIX: ALWAYS RENDER THE COMPONENT TO STABILIZE THE DOM TREE ---
-        import streamlit.components.v1 as _components
-        
-        fireworks_injection = ""
-        
-        if reaction_triggered:
-            _colors_js = str(reaction_colors)
-            _word_js = reaction_triggered
-            fireworks_injection = f"""<script>
-            (function() {{
-              var doc = window.parent.document;
-              var COLORS = {_colors_js};
-              var WORD = "{_word_js}";
-            
-              // Remove any existing overlays
-              ['__rx_canvas','__rx_word','__rx_kf'].forEach(function(id){{
-                var el = doc.getElementById(id); if(el) el.remove();
-              }});
-            
-              var canvas = doc.createElement('canvas');
-              canvas.id = '__rx_canvas';
-              canvas.style.cssText = 'position:fixed;top:0;left:0;width:100vw;height:100vh;pointer-events:none;z-index:2147483647;';
-              canvas.width = window.parent.innerWidth;
-              canvas.height = window.parent.innerHeight;
-              doc.body.appendChild(canvas);
-              var ctx = canvas.getContext('2d');
-            
-              var wordEl = doc.createElement('div');
-              wordEl.id = '__rx_word';
-              var c1=COLORS[0], c2=COLORS[Math.floor(COLORS.length/2)];
-              wordEl.innerText = WORD;
-              wordEl.style.cssText = 'position:fixed;top:50%;left:50%;transform:translate(-50%,-50%) scale(0);' +
-                'font-size:clamp(3rem,10vw,7rem);font-weight:900;letter-spacing:0.1em;pointer-events:none;' +
-                'z-index:2147483647;white-space:nowrap;font-family:Georgia,serif;' +
-                'background:linear-gradient(135deg,'+c1+','+c2+');-webkit-background-clip:text;' +
-                '-webkit-text-fill-color:transparent;background-clip:text;' +
-                'filter:drop-shadow(0 0 20px '+c1+') drop-shadow(0 0 40px '+c2+');' +
-                'animation:__rxPop 3.2s ease forwards;';
-              doc.body.appendChild(wordEl);
-            
-              if (!doc.getElementById('__rx_kf')) {{
-                var s = doc.createElement('style'); s.id='__rx_kf';
-                s.textContent = '@keyframes __rxPop {{' +
-                  '0%{{transform:translate(-50%,-50%) scale(0) rotate(-8deg);opacity:0}}' +
-                  '15%{{transform:translate(-50%,-50%) scale(1.35) rotate(3deg);opacity:1}}' +
-                  '30%{{transform:translate(-50%,-50%) scale(1.0) rotate(0);opacity:1}}' +
-                  '72%{{transform:translate(-50%,-50%) scale(1.0) rotate(0);opacity:1}}' +
-                  '100%{{transform:translate(-50%,-50%) scale(0.5) rotate(5deg);opacity:0}}' +
-                '}}';
-                doc.head.appendChild(s);
-              }}
-            
-              var P=[];
-              function rnd(a,b){{return a+Math.random()*(b-a);}}
-              function burst(x,y,n){{
-                for(var i=0;i<n;i++){{
-                  var angle=(Math.PI*2*i)/n+rnd(-0.4,0.4), speed=rnd(3,15);
-                  P.push({{x:x,y:y,vx:Math.cos(angle)*speed,vy:Math.sin(angle)*speed,
-                    alpha:1,size:rnd(4,11),color:COLORS[Math.floor(Math.random()*COLORS.length)],
-                    type:Math.random()<0.5?'star':'circle',grav:rnd(0.1,0.35),decay:rnd(0.013,0.025)}});
-                }}
-              }}
-              function sparkle(x,y){{
-                for(var i=0;i<6;i++){{
-                  var a=Math.random()*Math.PI*2,sp=rnd(1,5);
-                  P.push({{x:x,y:y,vx:Math.cos(a)*sp,vy:Math.sin(a)*sp-rnd(1,3),
-                    alpha:1,size:rnd(2,7),color:COLORS[Math.floor(Math.random()*COLORS.length)],
-                    type:'plus',grav:0.05,decay:rnd(0.025,0.05)}});
-                }}
-              }}
-              function dStar(x,y,r,color,alpha){{
-                ctx.save();ctx.globalAlpha=alpha;ctx.fillStyle=color;ctx.shadowColor=color;ctx.shadowBlur=10;
-                ctx.beginPath();
-                for(var i=0;i<5;i++){{
-                  var oa=(Math.PI*2*i)/5-Math.PI/2,ia=oa+Math.PI/5;
-                  i===0?ctx.moveTo(x+Math.cos(oa)*r,y+Math.sin(oa)*r):ctx.lineTo(x+Math.cos(oa)*r,y+Math.sin(oa)*r);
-                  ctx.lineTo(x+Math.cos(ia)*r*.45,y+Math.sin(ia)*r*.45);
-                }}
-                ctx.closePath();ctx.fill();ctx.restore();
-              }}
-              function dPlus(x,y,r,color,alpha){{
-                ctx.save();ctx.globalAlpha=alpha;ctx.strokeStyle=color;ctx.shadowColor=color;ctx.shadowBlur=12;ctx.lineWidth=2.5;
-                ctx.beginPath();
-                ctx.moveTo(x-r,y);ctx.lineTo(x+r,y);ctx.moveTo(x,y-r);ctx.lineTo(x,y+r);
-                ctx.moveTo(x-r*.7,y-r*.7);ctx.lineTo(x+r*.7,y+r*.7);ctx.moveTo(x+r*.7,y-r*.7);ctx.lineTo(x-r*.7,y+r*.7);
-                ctx.stroke();ctx.restore();
-              }}
-            
-              var W=canvas.width,H=canvas.height;
-              burst(W*.5,H*.3,65);burst(W*.2,H*.4,30);burst(W*.8,H*.4,30);burst(W*.15,H*.7,25);burst(W*.85,H*.7,25);
-              var bT=0,sT=0,elapsed=0,DUR=3400,last=performance.now();
-            
-              function frame(now){{
-                var dt=now-last;last=now;elapsed+=dt;
-                ctx.clearRect(0,0,W,H);
-                bT+=dt; if(bT>280&&elapsed<DUR*.75){{bT=0;burst(rnd(W*.05,W*.95),rnd(H*.05,H*.6),rnd(18,38));}}
-                sT+=dt; if(sT>70&&elapsed<DUR*.8){{sT=0;sparkle(rnd(30,W-30),rnd(30,H-30));}}
-                for(var i=P.length-1;i>=0;i--){{
-                  var p=P[i];
-                  p.vy+=p.grav;p.x+=p.vx;p.y+=p.vy;p.vx*=.98;p.alpha-=p.decay;
-                  var a=Math.max(0,p.alpha);
-                  if(p.type==='star')dStar(p.x,p.y,p.size,p.color,a);
-                  else if(p.type==='plus')dPlus(p.x,p.y,p.size,p.color,a);
-                  else{{ctx.save();ctx.globalAlpha=a;ctx.fillStyle=p.color;ctx.shadowColor=p.color;ctx.shadowBlur=6;
-                    ctx.beginPath();ctx.arc(p.x,p.y,p.size,0,Math.PI*2);ctx.fill();ctx.restore();}}
-                  if(p.alpha<=0)P.splice(i,1);
-                }}
-                if(elapsed<DUR+500)requestAnimationFrame(frame);
-                else{{canvas.remove();wordEl.remove();}}
-              }}
-              requestAnimationFrame(frame);
-            }})();
-            </script>"""
-
-        # We execute this component unconditionally. If there's no reaction, it injects an empty string.
-        # This keeps the YouTube iframe locked in its exact React index!
-        _components.html(fireworks_injection, height=0, scrolling=False)
-        # ------------------------------------------------------------------, height=0, scrolling=False)
-
-        if st.session_state[yt_url_key]:
-            _iframe_url = html.escape(st.session_state[yt_url_key], quote=True)
-            
-            components.html(
-                f"""
-                <iframe
-                    src="{_iframe_url}"
-                    width="100%"
-                    height="800"
-                    frameborder="0"
-                    allow="accelerometer; autoplay; clipboard-write;
-                           encrypted-media; gyroscope; picture-in-picture"
-                    allowfullscreen>
-                </iframe>
-                """,
-                height=800,
-            )
+            reaction_seq_key = f"{vc_id}_reaction_seq"
+            st.session_state[reaction_seq_key] = st.session_state.get(reaction_seq_key, 0) + 1
+            reaction_event = {"id": st.session_state[reaction_seq_key], "word": reaction_triggered, "colors": reaction_colors}
+
+        with section("vc.components.fireworks"):
+            reaction_overlay(reaction_event, key=f"{vc_id}_reaction_overlay")
+
+    @fragment
+    @timed("vc.karaoke_player")
+    def karaoke_player():
+        """YouTube player; its playing/ended reports rerun only this fragment"""
+        refresh()
+        video_id = st.session_state[yt_video_key] or None
+        with section("vc.components.youtube"):
+            player = youtube_player(video_id, height=800, key=f"{vc_id}_youtube_player")
+        if video_id and player and player["video_id"] == video_id and player["state"] == "ended":
+            if st.session_state[current_user_key] == vc_data["current_manager"]:
+                st.info("🎬 Song finished. Press ⏩ Advance for the next singer.")
+
+    yt_col, dummy_col, actions_col = st.columns([3, 0.1, 1])
+
+    with yt_col:
+        player_controls()
+        reactions_panel()
+
+        karaoke_player()
 
     with actions_col:
         # ----------- Visual Queue Display -----------
@@ -781,81 +619,7 @@ def render_vc_content(vc_id):
         st.markdown("---")
         st.markdown("**🎭 Up Next**")
 
-        queue = vc_data.get("queue", [])
-        calypso = vc_data.get("calypso", [])
-        pinged = vc_data.get("pinged", set())
-        role_assignments_vq = vc_data.get("role_assignments", {})
-        person_to_roles_vq = {}
-        for role_vq, people_vq in role_assignments_vq.items():
-            pool_vq = people_vq if isinstance(people_vq, list) else ([people_vq] if people_vq else [])
-            for p_vq in pool_vq:
-                if p_vq and p_vq != "— Unassigned —":
-                    person_to_roles_vq.setdefault(p_vq, []).append(role_vq)
-
-        def _vq_pb(person):
-            return ' <span style="font-size:0.65rem;background:#39ff14;color:white;border-radius:4px;padding:1px 4px;">📣</span>' if person in pinged else ""
-
-        def _vq_rt(person):
-            roles = person_to_roles_vq.get(person, [])
-            # Escape role strings to keep them secure
-            escaped_roles = [html.escape(r) for r in roles]
-            return f'<div style="font-size:0.9rem;color:#00ff88;margin:0;line-height:1.1;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">{", ".join(escaped_roles)}</div>' if roles else ""
-
-        if queue:
-            cards_html = '<div style="display:flex;flex-direction:column;gap:5px;margin-top:4px;">'
-
-            # #1 SINGING NOW — full width, gold (CENTERED)
-            p = queue[0]
-            escaped_p = html.escape(p)
-            cards_html += f'''
-            <div style="background:linear-gradient(135deg,#2a1a00,#5c3a00);border:1.5px solid #ffaa00;border-radius:8px;padding:7px 9px;text-align:center;">
-              <div style="font-size:1.58rem;color:#ffaa00;font-weight:700;letter-spacing:0.1em;text-transform:uppercase;line-height:1.1;">👑 SINGING NOW</div>
-              <div style="font-size:1.88rem;font-weight:700;color:#fff;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;margin:2px 0;">{escaped_p}{_vq_pb(p)}</div>
-              <div style="display:flex;justify-content:center;width:100%;line-height:1.1;">{_vq_rt(p)}</div>
-            </div>'''
-
-            # #2 NEXT UP — full width, blue (CENTERED)
-            if len(queue) >= 2:
-                p = queue[1]
-                escaped_p = html.escape(p)
-                cards_html += f'''
-                <div style="background:linear-gradient(135deg,#0d1f2d,#1a3a50);border:1.5px solid #4fc3f7;border-radius:8px;padding:7px 9px;text-align:center;">
-                  <div style="font-size:1.38rem;color:#4fc3f7;font-weight:700;letter-spacing:0.1em;text-transform:uppercase;line-height:1.1;">🌟 NEXT UP</div>
-                  <div style="font-size:1.68rem;font-weight:600;color:#fff;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;margin:2px 0;">{escaped_p}{_vq_pb(p)}</div>
-                  <div style="display:flex;justify-content:center;width:100%;line-height:1.1;">{_vq_rt(p)}</div>
-                </div>'''
-
-            # #3+ — 2-column grid, number inline with name, same font size, not bold
-            rest = queue[2:]
-            if rest:
-                cards_html += '<div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;">'
-                for j, p in enumerate(rest):
-                    num = j + 3
-                    escaped_p = html.escape(p)
-                    cards_html += f'''
-                    <div style="background:linear-gradient(135deg,#111118,#1a1a2e);border:1.5px solid #444466;border-radius:7px;padding:6px 8px;min-width:0;">
-                      <div style="font-size:1.00rem;font-weight:400;color:#ddd;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;"><span style="color:#888899;margin-right:4px;">#{num}</span>{escaped_p}{_vq_pb(p)}</div>
-                      {_vq_rt(p)}
-                    </div>'''
-                cards_html += '</div>'
-
-            cards_html += '</div>'
-
-            # Calypso — 2-column grid, inline name
-            if calypso:
-                cards_html += '<div style="margin-top:8px;font-size:1.05rem;color:#888;text-transform:uppercase;letter-spacing:0.08em;">🌴 Away with Calypso</div>'
-                cards_html += '<div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;margin-top:3px;">'
-                for person in calypso:
-                    escaped_person = html.escape(person)
-                    cards_html += f'''
-                    <div style="background:linear-gradient(135deg,#0d1a0d,#1a2d1a);border:1.5px solid #2d5a2d;border-radius:7px;padding:6px 8px;min-width:0;">
-                      <div style="font-size:1.00rem;font-weight:400;color:#aaffaa;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">🌴 {escaped_person}{_vq_pb(person)}</div>
-                    </div>'''
-                cards_html += '</div>'
-
-            st.html(cards_html)
-        else:
-            st.markdown('<div style="color:#666;font-size:0.85rem;text-align:center;padding:16px 0;">Queue is empty</div>', unsafe_allow_html=True)
+        render_up_next(vc_id)
             
         # Add people inside actions column
         st.markdown("---")
@@ -864,13 +628,8 @@ def render_vc_content(vc_id):
             name = st.session_state.get(f"{vc_id}_name_input_side", "").strip()
             name = name[:20]  # Hard enforcement of 20 chars maximum
             if name and name not in vc_data["queue"] and name not in vc_data["calypso"]:
-                vc_data["queue"].append(name)
                 st.session_state[f"{vc_id}_name_input_side"] = ""
-                save_state(vc_id, vc_data)
-                if vc_id == "vc1":
-                    st.session_state.vc1_data = vc_data
-                else:
-                    st.session_state.vc2_data = vc_data
+                commit_action({"op": "join", "name": name})
                 #st.rerun()
 
         input_col, button_col = st.columns([3, 1])
@@ -894,33 +653,19 @@ def render_vc_content(vc_id):
         if st.button("⏩ Advance", use_container_width=True, key=f"{vc_id}_advance"):
             if st.session_state[current_user_key] == vc_data["current_manager"]:
                 if vc_data["queue"]:
-                    first = vc_data["queue"].pop(0)
-                    vc_data["queue"].append(first)
-                    vc_data["selected_song"] = ""
-                    vc_data["role_assignments"] = {}
-                    st.session_state[yt_url_key] = ""
+                    st.session_state[yt_video_key] = ""
                     st.session_state[yt_title_key] = ""
-                    history_key_adv = f"{vc_id}_role_history"
-                    st.session_state[history_key_adv] = []
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
+                    from analytics import performance_record
+                    commit_action({"op": "advance"})
+                    # Built from the committed state, so a rebased advance logs who really sang
+                    get_analytics().record(performance_record(vc_id, vc_data))
                     st.rerun()
             else:
                 st.warning("Not managing.")
                 
         if st.button("🧹 Clear All", use_container_width=True, key=f"{vc_id}_clear"):
             if st.session_state[current_user_key] == vc_data["current_manager"]:
-                vc_data["queue"].clear()
-                vc_data["calypso"].clear()
-                vc_data["pinged"].clear()
-                save_state(vc_id, vc_data)
-                if vc_id == "vc1":
-                    st.session_state.vc1_data = vc_data
-                else:
-                    st.session_state.vc2_data = vc_data
+                commit_action({"op": "clear"})
                 st.rerun()
             else:
                 st.warning("Not managing.")
@@ -929,112 +674,88 @@ def render_vc_content(vc_id):
             st.rerun()
 
     # ----------- Quick Actions + Template -----------
-    qa_header_cols = st.columns([3, 1])
-    with qa_header_cols[0]:
-        st.markdown("<br><br>", unsafe_allow_html=True)
-        st.markdown("#### Quick Actions")
-    with qa_header_cols[1]:
-        st.markdown("<br>Select Template", unsafe_allow_html=True)
-        available_templates_qa = get_available_templates()
-        selected_template_qa = st.selectbox(
-            "Template",
-            available_templates_qa,
-            index=available_templates_qa.index(vc_data["current_template"]) if vc_data["current_template"] in available_templates_qa else 0,
-            key=f"{vc_id}_template_select",
-            label_visibility="collapsed"
-        )
-        if selected_template_qa != vc_data["current_template"]:
-            vc_data["current_template"] = selected_template_qa
-            save_state(vc_id, vc_data)
-            if vc_id == "vc1":
-                st.session_state.vc1_data = vc_data
-            else:
-                st.session_state.vc2_data = vc_data
-            st.rerun()
-    qa = st.columns(4)
-
-    def render_names(names, action_key):
-        cols = st.columns(2, gap="small")
-        for i, person in enumerate(names):
-            col = cols[i % 2]
-            with col:
-                st.markdown('<div class="name-btn">', unsafe_allow_html=True)
-                # Display escaped name on structural buttons safely
-                if st.button(person, key=f"{action_key}_{i}", use_container_width=True):
-                    return person
-                st.markdown('</div>', unsafe_allow_html=True)
-        return None
-
-    if st.session_state[current_user_key] == vc_data["current_manager"]:
-        with qa[0]:
-            if st.button("➖ Leave", use_container_width=True, key=f"{vc_id}_leave"):
-                st.session_state.show_leave = not st.session_state.show_leave
-                for flag in ["show_hold", "show_return", "show_ping"]:
-                    st.session_state[flag] = False
-            if st.session_state.show_leave:
-                person = render_names(vc_data["queue"], f"{vc_id}_Leave")
-                if person:
-                    vc_data["queue"].remove(person)
-                    vc_data["pinged"].discard(person)
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
-                    st.rerun()
-        with qa[1]:
-            if st.button("⏳ Hold", use_container_width=True, key=f"{vc_id}_hold"):
-                st.session_state.show_hold = not st.session_state.show_hold
-                for flag in ["show_leave", "show_return", "show_ping"]:
-                    st.session_state[flag] = False
-            if st.session_state.show_hold:
-                person = render_names(vc_data["queue"], f"{vc_id}_Hold")
-                if person:
-                    vc_data["queue"].remove(person)
-                    vc_data["calypso"].append(person)
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
-                    st.rerun()
-        with qa[2]:
-            if st.button("🏝️ Return", use_container_width=True, key=f"{vc_id}_return"):
-                st.session_state.show_return = not st.session_state.show_return
-                for flag in ["show_leave", "show_hold", "show_ping"]:
-                    st.session_state[flag] = False
-            if st.session_state.show_return:
-                person = render_names(vc_data["calypso"], f"{vc_id}_Return")
-                if person:
-                    vc_data["calypso"].remove(person)
-                    vc_data["queue"].append(person)
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
-                    st.rerun()
-        with qa[3]:
-            if st.button("📣 Ping/Unping", use_container_width=True, key=f"{vc_id}_ping"):
-                st.session_state.show_ping = not st.session_state.show_ping
-                for flag in ["show_leave", "show_hold", "show_return"]:
-                    st.session_state[flag] = False
-            if st.session_state.show_ping:
-                names = vc_data["queue"] + vc_data["calypso"]
-                person = render_names(names, f"{vc_id}_Ping")
-                if person:
-                    if person in vc_data["pinged"]:
-                        vc_data["pinged"].remove(person)
-                    else:
-                        vc_data["pinged"].add(person)
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
-                    st.rerun()
-    else:
-        st.info("⚠️ You are not managing the queue. Press 'Manage Queue' to interact with it.")
+    @fragment
+    @timed("vc.quick_actions")
+    def quick_actions():
+        """Leave / Hold / Return / Ping pickers and the template selector"""
+        refresh()
+        qa_header_cols = st.columns([3, 1])
+        with qa_header_cols[0]:
+            st.markdown("<br><br>", unsafe_allow_html=True)
+            st.markdown("#### Quick Actions")
+        with qa_header_cols[1]:
+            st.markdown("<br>Select Template", unsafe_allow_html=True)
+            available_templates_qa = get_available_templates()
+            selected_template_qa = st.selectbox(
+                "Template",
+                available_templates_qa,
+                index=available_templates_qa.index(vc_data["current_template"]) if vc_data["current_template"] in available_templates_qa else 0,
+                key=f"{vc_id}_template_select",
+                label_visibility="collapsed"
+            )
+            if selected_template_qa != vc_data["current_template"]:
+                commit_action({"op": "set", "fields": {"current_template": selected_template_qa}})
+                st.rerun()
+        qa = st.columns(4)
+
+        def render_names(names, action_key):
+            cols = st.columns(2, gap="small")
+            for i, person in enumerate(names):
+                col = cols[i % 2]
+                with col:
+                    st.markdown('<div class="name-btn">', unsafe_allow_html=True)
+                    # Display escaped name on structural buttons safely
+                    if st.button(person, key=f"{action_key}_{i}", use_container_width=True):
+                        return person
+                    st.markdown('</div>', unsafe_allow_html=True)
+            return None
+
+        if st.session_state[current_user_key] == vc_data["current_manager"]:
+            with qa[0]:
+                if st.button("➖ Leave", use_container_width=True, key=f"{vc_id}_leave"):
+                    st.session_state.show_leave = not st.session_state.show_leave
+                    for flag in ["show_hold", "show_return", "show_ping"]:
+                        st.session_state[flag] = False
+                if st.session_state.show_leave:
+                    person = render_names(vc_data["queue"], f"{vc_id}_Leave")
+                    if person:
+                        commit_action({"op": "leave", "name": person})
+                        st.rerun()
+            with qa[1]:
+                if st.button("⏳ Hold", use_container_width=True, key=f"{vc_id}_hold"):
+                    st.session_state.show_hold = not st.session_state.show_hold
+                    for flag in ["show_leave", "show_return", "show_ping"]:
+                        st.session_state[flag] = False
+                if st.session_state.show_hold:
+                    person = render_names(vc_data["queue"], f"{vc_id}_Hold")
+                    if person:
+                        commit_action({"op": "hold", "name": person})
+                        st.rerun()
+            with qa[2]:
+                if st.button("🏝️ Return", use_container_width=True, key=f"{vc_id}_return"):
+                    st.session_state.show_return = not st.session_state.show_return
+                    for flag in ["show_leave", "show_hold", "show_ping"]:
+                        st.session_state[flag] = False
+                if st.session_state.show_return:
+                    person = render_names(vc_data["calypso"], f"{vc_id}_Return")
+                    if person:
+                        commit_action({"op": "return", "name": person})
+                        st.rerun()
+            with qa[3]:
+                if st.button("📣 Ping/Unping", use_container_width=True, key=f"{vc_id}_ping"):
+                    st.session_state.show_ping = not st.session_state.show_ping
+                    for flag in ["show_leave", "show_hold", "show_return"]:
+                        st.session_state[flag] = False
+                if st.session_state.show_ping:
+                    names = vc_data["queue"] + vc_data["calypso"]
+                    person = render_names(names, f"{vc_id}_Ping")
+                    if person:
+                        commit_action({"op": "ping", "name": person, "on": person not in vc_data["pinged"]})
+                        st.rerun()
+        else:
+            st.info("⚠️ You are not managing the queue. Press 'Manage Queue' to interact with it.")
+
+    quick_actions()
 
     # ----------- Layout: Reorder + Output -----------
     if vc_data["queue"]:
@@ -1047,24 +768,14 @@ def render_vc_content(vc_id):
         # =========================================================
         # 👈 LEFT MAIN COLUMN: QUEUE MANAGER
         # =========================================================
-        with queue_panel_col:
+        @fragment
+        @timed("vc.queue_manager")
+        def queue_manager():
+            """Reorder list and Discord output"""
+            refresh()
             st.markdown("---")
             st.markdown("### Queue Manager")
 
-            role_assignments = vc_data.get("role_assignments", {})
-            person_to_roles = {}
-            for role, people in role_assignments.items():
-                loop_pool = people if isinstance(people, list) else ([people] if people else [])
-                for person in loop_pool:
-                    if person and person != "— Unassigned —":
-                        person_to_roles.setdefault(person, []).append(role)
-
-            def fmt_name_plain(name):
-                ping = " 📣" if name in vc_data["pinged"] else ""
-                roles_for = person_to_roles.get(name, [])
-                role_tag = " [" + ", ".join(roles_for) + "]" if roles_for else ""
-                return f"{name}{ping}{role_tag}"
-
             left, right = st.columns([1, 2])
             with left:
                 st.markdown("#### 🔀 Reorder")
@@ -1073,79 +784,67 @@ def render_vc_content(vc_id):
 
                     sortable_key = f"sortable_{vc_id}_{len(vc_data['queue'])}_{hash(tuple(vc_data['queue']))}_{st.session_state.rev}"
 
-                    reordered_display = sortables.sort_items(
-                        display_items,
-                        direction="vertical",
-                        key=sortable_key
-                    )
+                    import streamlit_sortables as sortables  # Only managers see the reorder list
+
+                    with section("vc.reorder.sortable"):
+                        reordered_display = sortables.sort_items(
+                            display_items,
+                            direction="vertical",
+                            key=sortable_key
+                        )
                     display_to_name = {
                         (f"{p} 📣" if p in vc_data["pinged"] else p): p for p in vc_data["queue"]
                     }
                     
                     reordered_names = [display_to_name.get(d, d) for d in reordered_display]
                     if reordered_names != vc_data["queue"]:
-                        vc_data["queue"] = reordered_names
-                        save_state(vc_id, vc_data)
-                        if vc_id == "vc1":
-                            st.session_state.vc1_data = vc_data
+                        # A single drag is sent as a move so it merges with concurrent joins
+                        move = find_move(vc_data["queue"], reordered_names)
+                        if move:
+                            commit_action({"op": "move", "name": move[0], "position": move[1]})
                         else:
-                            st.session_state.vc2_data = vc_data
+                            commit_action({"op": "reorder", "queue": reordered_names})
                         st.rerun()
                 else:
                     st.info("🔹 Only the manager can reorder.")
 
             with right:
-                current_template = load_template(vc_data["current_template"])
-
-                # Sanitize template variables before formatting codeblock presentation block
-                t_title = html.escape(current_template.get('title', ''))
-                t_url = current_template.get('url', '')
-                t_tmpl = html.escape(vc_data['current_template'])
-                t_mngr = html.escape(vc_data['current_manager'] if vc_data['current_manager'] else '-')
-                t_song = html.escape(active_song)
-
-                output = f"{t_title}\n"
-                output += f"{t_url}\n"
-                output += f"Template by: {t_tmpl}\n"
-                output += f"Managed by: {t_mngr}\n"
-                if active_song:
-                    output += f"🎵 {t_song}\n"
-                output += "-# ------------------\n"
-                output += f"{current_template['currently_singing']}\n{current_template['current_symbol']} {fmt_name_plain(vc_data['queue'][0]) if len(vc_data['queue'])>=1 else '-'}\n"
-                output += "-# ------------------\n"
-                output += f"{current_template['next_up']}\n{current_template['next_symbol']} {fmt_name_plain(vc_data['queue'][1]) if len(vc_data['queue'])>=2 else '-'}\n"
-                output += "-# ------------------\n" + current_template['on_queue'] + "\n"
-                if len(vc_data["queue"]) > 2:
-                    for person in vc_data["queue"][2:]:
-                        output += f"{current_template['queue_symbol']} {fmt_name_plain(person)}\n"
-                else:
-                    output += "- None\n"
-                output += "-# ------------------\n" + current_template['away_calypso'] + "\n"
-                if vc_data["calypso"]:
-                    for person in vc_data["calypso"]:
-                        output += f"{current_template['calypso_symbol']} {fmt_name_plain(person)}\n"
-                else:
-                    output += "- None\n"
-                output += "-# ------------------\nReact to join the legend:\n" + current_template['reactions'] + "\n"
-                output += "-# ------------------\n"
-                output += f"{current_template['wheel_link']}\n"
-                st.code(output, language="text")
+                render_discord_output(vc_id)
+
+        with queue_panel_col:
+            queue_manager()
 
         # =========================================================
         # 👉 RIGHT MAIN COLUMN: ROLE ASSIGNMENT
         # =========================================================
-        with roles_panel_col:
+        def undo_redo(kind):
+            """Step the VC's shared role/song log back or forward"""
+            song_before = vc_data.get("selected_song", "")
+            st.session_state.rev += 1
+            commit_action({"op": kind})
+            if vc_data.get("selected_song", "") != song_before:
+                # The song selector lives in another fragment and is already drawn
+                st.session_state[f"{vc_id}_song_select_pending"] = vc_data.get("selected_song") or "— Select a song —"
+                st.rerun()
+            rerun_fragment()
+
+        @fragment
+        @timed("vc.role_assignment")
+        def role_assignment():
+            """Role pickers, role editor and role wars for the selected song"""
+            refresh()
+            active_song = vc_data.get("selected_song", "")
             st.markdown("---")
             st.markdown("### 🎭 Role Assignment")
 
-            history_key = f"{vc_id}_role_history"
             is_manager = st.session_state[current_user_key] == vc_data["current_manager"]
             song_list = list(EPIC_SONGS.keys())
 
             current_song = vc_data.get("selected_song", "")
 
             if active_song and active_song in EPIC_SONGS:
-                custom_roles_map = vc_data.get("custom_roles", {})
+                # The editor changes this copy; the shared snapshot is only replaced by the commit
+                custom_roles_map = copy.deepcopy(vc_data.get("custom_roles", {}))
                 song_custom = custom_roles_map.get(active_song, {})
                 roles = song_custom.get("roles", list(EPIC_SONGS[active_song]))
                 custom_icons = song_custom.get("icons", {})
@@ -1158,7 +857,7 @@ def render_vc_content(vc_id):
                     else:
                         assignments[k] = [v] if v and v != "— Unassigned —" else []
 
-                all_people = vc_data["queue"]
+                all_people = list(vc_data["queue"])
 
                 title_col, edit_col = st.columns([5, 1])
                 with title_col:
@@ -1186,7 +885,7 @@ def render_vc_content(vc_id):
                                 if st.button("Unlock", key=f"{vc_id}_role_edit_unlock", use_container_width=True):
                                     if entered_pc == ROLE_EDIT_PASSCODE:
                                         st.session_state[auth_key] = True
-                                        st.rerun()
+                                        rerun_fragment()
                                     else:
                                         st.error("❌ Incorrect passcode.")
                         else:
@@ -1218,28 +917,19 @@ def render_vc_content(vc_id):
                                         custom_roles_map.setdefault(active_song, {"roles": list(roles), "icons": {}})
                                         custom_roles_map[active_song]["roles"] = list(roles)
                                         custom_roles_map[active_song]["icons"] = custom_icons
-                                        vc_data["custom_roles"] = custom_roles_map
-                                        save_state(vc_id, vc_data)
-                                        if vc_id == "vc1":
-                                            st.session_state.vc1_data = vc_data
-                                        else:
-                                            st.session_state.vc2_data = vc_data
-                                        st.rerun()
+                                        commit_action({"op": "set", "fields": {"custom_roles": custom_roles_map}})
+                                        rerun_fragment()
                                 with er_col3:
                                     if st.button("🗑️", key=f"{vc_id}_role_del_{active_song}_{role_name}", use_container_width=True):
                                         new_roles = [r for r in roles if r != role_name]
                                         custom_icons.pop(role_name, None)
                                         custom_roles_map[active_song] = {"roles": new_roles, "icons": custom_icons}
-                                        vc_data["custom_roles"] = custom_roles_map
+                                        changed_fields = {"custom_roles": custom_roles_map}
                                         if role_name in assignments:
                                             assignments.pop(role_name)
-                                            vc_data["role_assignments"] = assignments
-                                        save_state(vc_id, vc_data)
-                                        if vc_id == "vc1":
-                                            st.session_state.vc1_data = vc_data
-                                        else:
-                                            st.session_state.vc2_data = vc_data
-                                        st.rerun()
+                                            changed_fields["role_assignments"] = assignments
+                                        commit_action({"op": "set", "fields": changed_fields})
+                                        rerun_fragment()
 
                             st.markdown("---")
                             st.markdown("**➕ Add a role**")
@@ -1266,20 +956,15 @@ def render_vc_content(vc_id):
                                         new_roles = list(roles) + [clean_role]
                                         custom_icons[clean_role] = ROLE_SYMBOL_OPTIONS[new_role_sym_label]
                                         custom_roles_map[active_song] = {"roles": new_roles, "icons": custom_icons}
-                                        vc_data["custom_roles"] = custom_roles_map
-                                        save_state(vc_id, vc_data)
-                                        if vc_id == "vc1":
-                                            st.session_state.vc1_data = vc_data
-                                        else:
-                                            st.session_state.vc2_data = vc_data
-                                        st.rerun()
+                                        commit_action({"op": "set", "fields": {"custom_roles": custom_roles_map}})
+                                        rerun_fragment()
                                     elif clean_role in roles:
                                         st.warning("That role already exists.")
 
                             if st.button("🔒 Lock & Close Editor", key=f"{vc_id}_role_edit_lock", use_container_width=True):
                                 st.session_state[auth_key] = False
                                 st.session_state[edit_toggle_key] = False
-                                st.rerun()
+                                rerun_fragment()
 
                     # Refresh local roles/icons after any edits made above
                     custom_roles_map = vc_data.get("custom_roles", {})
@@ -1290,18 +975,7 @@ def render_vc_content(vc_id):
                 def role_icon(role):
                     if role in custom_icons:
                         return custom_icons[role]
-                    r = role.lower()
-                    if any(x in r for x in ["zeus", "poseidon", "athena", "hermes", "hera", "aphrodite", "ares", "apollo", "hephaestus"]):
-                        return "⚡"
-                    if any(x in r for x in ["odysseus", "telemachus", "penelope", "antinous"]):
-                        return "⚔️"
-                    if any(x in r for x in ["circe", "calypso", "siren", "scylla", "charybdis"]):
-                        return "🌊"
-                    if any(x in r for x in ["crew", "ensemble", "suitors", "soldiers", "souls", "spirits"]):
-                        return "👥"
-                    if any(x in r for x in ["polyphemus", "cyclops", "monster", "beast"]):
-                        return "👁️"
-                    return "🎶"
+                    return song_catalog.icon(role)
 
                 changed = False
                 war_triggered = False
@@ -1325,14 +999,15 @@ def render_vc_content(vc_id):
                     
                     with row_col2:
                         st.markdown("<br>", unsafe_allow_html=True)
-                        picked_list = st.multiselect(
-                            f"Assign {role}",
-                            options=all_people,
-                            default=default_assigned,
-                            key=f"{vc_id}_role_multi_{role}_{active_song}_{st.session_state.rev}",
-                            disabled=not is_manager,
-                            label_visibility="collapsed"
-                        )
+                        with section("vc.roles.multiselect"):
+                            picked_list = st.multiselect(
+                                f"Assign {role}",
+                                options=all_people,
+                                default=default_assigned,
+                                key=f"{vc_id}_role_multi_{role}_{active_song}_{st.session_state.rev}",
+                                disabled=not is_manager,
+                                label_visibility="collapsed"
+                            )
                         if not war_triggered and set(picked_list) != set(default_assigned):
                             changed = True
                             new_assignments[role] = picked_list
@@ -1366,75 +1041,37 @@ def render_vc_content(vc_id):
                             random.shuffle(st.session_state.gif_pool)
                         
                         chosen_anime = st.session_state.gif_pool.pop()
-                        battle_placeholder = st.empty()
-                        
-                        for timer in range(5, 0, -1):
-                            battle_placeholder.markdown(
-                                f"""
-                                <div style="text-align: center; padding: 8px; background-color: #0c0c0c; border: 2px dashed #ff4b4b; border-radius: 8px; margin: 5px 0;">
-                                    <h4 style="color: #ff4b4b; margin: 0; font-family: sans-serif; font-size: 1.1rem; text-shadow: 0 0 5px #ff0000;">🔥 ROLE WAR FOR {html.escape(role.upper())}! 🔥</h4>
-                                    <p style="font-size: 0.95rem; font-weight: bold; color: white; margin: 4px 0;">Clashing finishes in {timer}...</p>
-                                    <img src="{chosen_anime}" style="width: 100%; max-width: 470px; border-radius: 6px; border: 1.5px solid #fff;"/>
-                                </div>
-                                """,
-                                unsafe_allow_html=True
-                            )
-                            time.sleep(1.0)
-                        
+                        # Decided now; the countdown is only played back in the browser
                         winner = random.choice(picked_list)
-                        battle_placeholder.empty()
-                        
-                        st.session_state[history_key].append({
-                            "selected_song": active_song,
-                            "role_assignments": dict(vc_data.get("role_assignments", {}))
-                        })
                         
                         new_assignments[role] = [winner]
-                        vc_data["role_assignments"] = new_assignments
                         st.session_state.rev += 1
-                        save_state(vc_id, vc_data)
-                        
-                        if vc_id == "vc1":
-                            st.session_state.vc1_data = vc_data
-                        else:
-                            st.session_state.vc2_data = vc_data
-                            
-                        st.toast(f"🏆 {html.escape(winner)} won the fight for {html.escape(role)}!")
+                        commit_action({"op": "set", "fields": {"role_assignments": new_assignments}})
+                        st.session_state[f"{vc_id}_war_animation"] = war_animation_script(role, chosen_anime, winner)
                         st.balloons()
-                        st.rerun()
+                        rerun_fragment()
 
                 if is_manager and changed and not war_triggered:
-                    st.session_state[history_key].append({
-                        "selected_song": active_song,
-                        "role_assignments": dict(assignments)
-                    })
-                    vc_data["role_assignments"] = new_assignments
-                    save_state(vc_id, vc_data)
-                    if vc_id == "vc1":
-                        st.session_state.vc1_data = vc_data
-                    else:
-                        st.session_state.vc2_data = vc_data
-                    st.rerun()
+                    commit_action({"op": "set", "fields": {"role_assignments": new_assignments}})
+                    rerun_fragment()
 
                 if is_manager:
-                    clear_col, _ = st.columns([1, 3])
+                    clear_col, auto_col, _ = st.columns([1, 1, 2])
+                    with auto_col:
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        if st.button("🤖 Auto-assign", use_container_width=True, key=f"{vc_id}_role_auto",
+                                     help="Fill every role, favouring people who sang it least"):
+                            st.session_state.rev += 1
+                            auto = fair_assignment(roles, all_people, vc_data.get("role_counts", {}))
+                            commit_action({"op": "set", "fields": {"role_assignments": {role: auto.get(role, []) for role in roles}}})
+                            rerun_fragment()
                     with clear_col:
                         st.markdown("<br>", unsafe_allow_html=True)
                         if st.button("🗑️ Clear Roles", use_container_width=True, key=f"{vc_id}_role_clear"):
-                            st.session_state[history_key].append({
-                                "selected_song": active_song,
-                                "role_assignments": dict(vc_data.get("role_assignments", {}))
-                            })
-                            
-                            vc_data["role_assignments"] = {}
                             st.session_state.rev += 1
                             
-                            save_state(vc_id, vc_data)
-                            if vc_id == "vc1":
-                                st.session_state.vc1_data = vc_data
-                            else:
-                                st.session_state.vc2_data = vc_data
-                            st.rerun()
+                            commit_action({"op": "set", "fields": {"role_assignments": {}}})
+                            rerun_fragment()
             elif active_song:
                 st.info("Song not found in database.")
             else:
@@ -1442,13 +1079,28 @@ def render_vc_content(vc_id):
                     st.info("Search, select, or spin a song above to assign roles.")
                 else:
                     st.info("The manager hasn't selected a song yet.")
+
+            # Shared per VC, so any manager can step back through song/role changes
+            if is_manager:
+                undo_col, redo_col, _ = st.columns([1, 1, 2])
+                with undo_col:
+                    if st.button("↩️ Undo", use_container_width=True, key=f"{vc_id}_role_undo", disabled=not vc_data.get("role_undo")):
+                        undo_redo("undo")
+                with redo_col:
+                    if st.button("↪️ Redo", use_container_width=True, key=f"{vc_id}_role_redo", disabled=not vc_data.get("role_redo")):
+                        undo_redo("redo")
+
+            with section("vc.components.war"):
+                components.html(st.session_state.pop(f"{vc_id}_war_animation", ""), height=0)
+
+        with roles_panel_col:
+            role_assignment()
+
+    st.session_state[version_key] = max(st.session_state[version_key], render_version)
                 
 # Render selected section
-if selected_tab == "🎵 VC 1":
-    render_vc_content("vc1")
-
-elif selected_tab == "🎵 VC 2":
-    render_vc_content("vc2")
+if selected_tab in room_tabs:
+    render_vc_content(room_tabs[selected_tab])
 
 elif selected_tab == "✨ Customize":
     # ----------- CUSTOMIZE TAB CONTENT -----------
@@ -1456,14 +1108,16 @@ elif selected_tab == "✨ Customize":
     
     st.markdown("**Select or create a template to customize the queue appearance.**")
     
-    available_templates = get_available_templates()
+    with section("customize.templates"):
+        available_templates = get_available_templates()
     selected_template = st.selectbox(
         "Select Template",
         available_templates,
         index=0
     )
     
-    template = load_template(selected_template)
+    with section("customize.templates"):
+        template = load_template(selected_template)
     
     st.markdown("---")
     st.subheader("Edit Template Fields")
@@ -1486,6 +1140,16 @@ elif selected_tab == "✨ Customize":
         st.text_area("Reactions Info", value=template.get("reactions", ""), key="tmpl_reactions", height=80, max_chars=500)
         st.text_input("Wheel Link", value=template.get("wheel_link", ""), key="tmpl_wheel_link", max_chars=100)
     
+    st.text_area(
+        "Layout",
+        value=template.get("layout") or discord_output.DEFAULT_LAYOUT,
+        key="tmpl_layout",
+        height=260,
+        max_chars=3000,
+        help="Placeholders: {title} {template_name} {manager} {song} {current} {next} {queue} {calypso} {roles}, "
+             "plus any template field such as {next_symbol}. Lines starting with ? are hidden when empty.",
+    )
+    
     st.markdown("---")
     
     # Preview
@@ -1504,37 +1168,11 @@ elif selected_tab == "✨ Customize":
         "reactions": st.session_state.tmpl_reactions,
         "wheel_link": st.session_state.tmpl_wheel_link
     }
+    if st.session_state.tmpl_layout.strip() != discord_output.DEFAULT_LAYOUT.strip():
+        preview_template["layout"] = st.session_state.tmpl_layout
     
-    # Escape fields explicitly so they render harmlessly in the preview text area
-    p_title = html.escape(preview_template['title'])
-    p_url = preview_template['url']
-    p_curr_sing = html.escape(preview_template['currently_singing'])
-    p_curr_sym = html.escape(preview_template['current_symbol'])
-    p_next_up = html.escape(preview_template['next_up'])
-    p_next_sym = html.escape(preview_template['next_symbol'])
-    p_on_q = html.escape(preview_template['on_queue'])
-    p_q_sym = html.escape(preview_template['queue_symbol'])
-    p_away = html.escape(preview_template['away_calypso'])
-    p_cal_sym = html.escape(preview_template['calypso_symbol'])
-    p_react = html.escape(preview_template['reactions'])
-    p_wheel = html.escape(preview_template['wheel_link'])
-
-    preview_output = f"{p_title}\n"
-    preview_output += f"{p_url}\n"
-    preview_output += f"Template by: {html.escape(selected_template)}\n"
-    preview_output += "Managed by: [Manager Name]\n"
-    preview_output += "-# ------------------\n"
-    preview_output += f"{p_curr_sing}\n{p_curr_sym} [Person 1]\n"
-    preview_output += "-# ------------------\n"
-    preview_output += f"{p_next_up}\n{p_next_sym} [Person 2]\n"
-    preview_output += "-# ------------------\n" + p_on_q + "\n"
-    preview_output += f"{p_q_sym} [Person 3]\n"
-    preview_output += "-# ------------------\n" + p_away + "\n"
-    preview_output += f"{p_cal_sym} [Person 4]\n"
-    preview_output += "-# ------------------\nReact to join the legend:\n" + p_react + "\n"
-    preview_output += "-# ------------------\n"
-    preview_output += f"{p_wheel}\n"
-    
+    with section("customize.preview"):
+        preview_output = discord_output.render_preview(preview_template, selected_template)
     st.code(preview_output, language="text")
     
     st.markdown("---")
@@ -1551,7 +1189,7 @@ elif selected_tab == "✨ Customize":
             st.error("❌ Template name cannot be empty.")
         else:
             # Proceed with saving your template normally
-            save_template(new_template_name.strip(), current_config)
+            save_template(new_template_name.strip(), preview_template)
     
     st.markdown("---")
     st.subheader("📚 Available Templates")
@@ -1609,6 +1247,106 @@ elif selected_tab == "✨ Customize":
     elif passcode_input and not st.session_state.admin_authenticated:
         st.error("❌ Incorrect passcode!")
 
+    if st.session_state.admin_authenticated and passcode_input == ADMIN_PASSCODE:
+        st.markdown("---")
+        st.subheader("🏠 Rooms")
+        st.caption(", ".join(html.escape(room["name"]) for room in room_registry.list()))
+        room_col1, room_col2 = st.columns([3, 1])
+        with room_col1:
+            new_room_name = st.text_input(
+                "Room name",
+                max_chars=20,
+                key="new_room_name",
+                label_visibility="collapsed",
+                placeholder="New room name (Max 20 chars)"
+            ).strip()
+        with room_col2:
+            if st.button("➕ Create Room", use_container_width=True, key="create_room_btn"):
+                if new_room_name:
+                    room_registry.create(new_room_name)
+                    st.success(f"✅ Room '{html.escape(new_room_name)}' created!")
+                    st.rerun()
+                else:
+                    st.warning("Type a room name first.")
+
+        st.markdown("---")
+        st.subheader("📊 Analytics")
+        analytics = get_analytics()
+        stats_rooms = {"All rooms": None}
+        stats_rooms.update({room["name"]: room["id"] for room in room_registry.list()})
+        stats_periods = {"Last 24 hours": 86400, "Last 7 days": 7 * 86400, "Last 30 days": 30 * 86400, "All time": None}
+        stats_col1, stats_col2 = st.columns(2)
+        with stats_col1:
+            stats_room = stats_rooms[st.selectbox("Room", list(stats_rooms), key="stats_room")]
+        with stats_col2:
+            stats_period = stats_periods[st.selectbox("Period", list(stats_periods), index=1, key="stats_period")]
+        stats_since = time.time() - stats_period if stats_period else None
+
+        with section("customize.analytics"):
+            songs_sung = analytics.count(stats_room, stats_since)
+        avg_wait = analytics.average_wait(stats_room, stats_since)
+        metric_col1, metric_col2 = st.columns(2)
+        metric_col1.metric("🎤 Songs sung", songs_sung)
+        metric_col2.metric("⏳ Average wait", f"{avg_wait / 60:.1f} min" if avg_wait is not None else "-")
+
+        if songs_sung:
+            top_col1, top_col2, top_col3 = st.columns(3)
+            for col, title, rows, label in (
+                (top_col1, "Top singers", analytics.top_singers(10, stats_room, stats_since), "Singer"),
+                (top_col2, "Most-sung songs", analytics.top_songs(10, stats_room, stats_since), "Song"),
+                (top_col3, "Most-sung roles", analytics.top_roles(10, stats_room, stats_since), "Role"),
+            ):
+                with col:
+                    st.markdown(f"**{title}**")
+                    st.dataframe({label: [r[0] for r in rows], "Times": [r[1] for r in rows]}, hide_index=True, use_container_width=True)
+
+            bucket = 3600 if stats_period and stats_period <= 86400 else 86400
+            starts, lengths = analytics.queue_length_over_time(bucket, stats_room, stats_since)
+            from datetime import datetime
+            st.markdown("**Queue length over time**")
+            st.line_chart({"time": [datetime.fromtimestamp(t) for t in starts], "queue length": lengths}, x="time", y="queue length")
+        else:
+            st.info("No songs recorded yet for this selection.")
+
+        st.markdown("---")
+        st.subheader("⏱️ Profiling")
+        profiling.enable(st.toggle("Record section timings", value=profiling.enabled(), key="profiling_toggle"))
+        st.caption("Rolling timings of the last reruns, across all sessions. Near-zero cost while off.")
+        profile_rows = profiling.stats()
+        if profile_rows:
+            st.dataframe(
+                {key: [round(row[key], 2) if key.endswith("_ms") else row[key] for row in profile_rows] for key in profile_rows[0]},
+                hide_index=True,
+                use_container_width=True,
+            )
+        else:
+            st.info("No timings recorded yet. Turn recording on and use a room.")
+        prof_col1, prof_col2 = st.columns(2)
+        with prof_col1:
+            st.download_button(
+                "⬇️ Export trace (JSON)",
+                data=profiling.export_trace(),
+                file_name="queue_trace.json",
+                mime="application/json",
+                use_container_width=True,
+                help="Chrome trace format: open in chrome://tracing, Perfetto or speedscope",
+            )
+        with prof_col2:
+            if st.button("🧹 Reset timings", use_container_width=True, key="profiling_reset"):
+                profiling.reset()
+                st.rerun()
+
+        st.subheader("⏺️ Traffic Recording")
+        st.caption("Writes every VC rerun and queue action to traces/ for replay with benchmarks/replay.py. Traces include the names people typed.")
+        if recorder.recording():
+            st.info(f"Recording to `{recorder.recording()}`")
+            if st.button("⏹️ Stop recording", use_container_width=True, key="recorder_stop"):
+                recorder.stop()
+                st.rerun()
+        elif st.button("⏺️ Start recording", use_container_width=True, key="recorder_start"):
+            recorder.start()
+            st.rerun()
+
 # --- Custom Styling for small UI elements ---
 st.markdown("""
     <style>
@@ -1632,8 +1370,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Auto-select-all text in Streamlit selectbox on click
-import streamlit.components.v1 as _components_global
-_components_global.html("""<script>
+components.html("""<script>
 (function() {
   function attachSelectAll() {
     var inputs = window.parent.document.querySelectorAll('[data-baseweb="select"] input');
@@ -0,0 +1,102 @@
+"""HTML for the "Up Next" card panel.
+
+Cards are cached per (position, name, pinged, roles) and whole panels per VC
+and state version. The caches live here rather than in streamlit_app.py,
+which Streamlit runs as a fresh ``__main__`` on every full rerun.
+"""
+import functools
+import html
+
+from discord_output import person_roles
+from profiling import section
+
+PING_BADGE_HTML = ' <span style="font-size:0.65rem;background:#39ff14;color:white;border-radius:4px;padding:1px 4px;">📣</span>'
+
+_panels = {}  # vc_id -> (state version, panel html)
+
+
+def _roles_html(roles):
+    # Escape role strings to keep them secure
+    return f'<div style="font-size:0.9rem;color:#00ff88;margin:0;line-height:1.1;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">{", ".join(html.escape(r) for r in roles)}</div>' if roles else ""
+
+
+@functools.lru_cache(maxsize=4096)
+def card(position, name, pinged, roles):
+    """HTML for one Up Next card; "rest" cards leave a {num} slot for their position"""
+    escaped = html.escape(name)
+    badge = PING_BADGE_HTML if pinged else ""
+    if position == "now":
+        # #1 SINGING NOW — full width, gold (CENTERED)
+        return f'''
+        <div style="background:linear-gradient(135deg,#2a1a00,#5c3a00);border:1.5px solid #ffaa00;border-radius:8px;padding:7px 9px;text-align:center;">
+          <div style="font-size:1.58rem;color:#ffaa00;font-weight:700;letter-spacing:0.1em;text-transform:uppercase;line-height:1.1;">👑 SINGING NOW</div>
+          <div style="font-size:1.88rem;font-weight:700;color:#fff;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;margin:2px 0;">{escaped}{badge}</div>
+          <div style="display:flex;justify-content:center;width:100%;line-height:1.1;">{_roles_html(roles)}</div>
+        </div>'''
+    if position == "next":
+        # #2 NEXT UP — full width, blue (CENTERED)
+        return f'''
+            <div style="background:linear-gradient(135deg,#0d1f2d,#1a3a50);border:1.5px solid #4fc3f7;border-radius:8px;padding:7px 9px;text-align:center;">
+              <div style="font-size:1.38rem;color:#4fc3f7;font-weight:700;letter-spacing:0.1em;text-transform:uppercase;line-height:1.1;">🌟 NEXT UP</div>
+              <div style="font-size:1.68rem;font-weight:600;color:#fff;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;margin:2px 0;">{escaped}{badge}</div>
+              <div style="display:flex;justify-content:center;width:100%;line-height:1.1;">{_roles_html(roles)}</div>
+            </div>'''
+    if position == "rest":
+        # #3+ — number inline with name, same font size, not bold
+        return (
+            '''
+                <div style="background:linear-gradient(135deg,#111118,#1a1a2e);border:1.5px solid #444466;border-radius:7px;padding:6px 8px;min-width:0;">
+                  <div style="font-size:1.00rem;font-weight:400;color:#ddd;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;line-height:1.2;"><span style="color:#888899;margin-right:4px;">#''',
+            f'''</span>{escaped}{badge}</div>
+                  {_roles_html(roles)}
+                </div>''',
+        )
+    # Calypso — inline name
+    return f'''
+                <div style="background:linear-gradient(135deg,#0d1a0d,#1a2d1a);border:1.5px solid #2d5a2d;border-radius:7px;padding:6px 8px;min-width:0;">
+                  <div style="font-size:1.00rem;font-weight:400;color:#aaffaa;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">🌴 {escaped}{badge}</div>
+                </div>'''
+
+
+def build_html(vc_data):
+    """HTML for the "Up Next" card panel, or "" when the queue is empty"""
+    queue = vc_data.get("queue", [])
+    if not queue:
+        return ""
+    calypso = vc_data.get("calypso", [])
+    pinged = vc_data.get("pinged", set())
+    person_to_roles = person_roles(vc_data.get("role_assignments", {}))
+
+    def person_card(position, person):
+        return card(position, person, person in pinged, tuple(person_to_roles.get(person, ())))
+
+    parts = ['<div style="display:flex;flex-direction:column;gap:5px;margin-top:4px;">', person_card("now", queue[0])]
+    if len(queue) >= 2:
+        parts.append(person_card("next", queue[1]))
+
+    # #3+ — 2-column grid
+    if len(queue) > 2:
+        parts.append('<div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;">')
+        for num, person in enumerate(queue[2:], start=3):
+            head, tail = person_card("rest", person)
+            parts += (head, str(num), tail)
+        parts.append('</div>')
+    parts.append('</div>')
+
+    # Calypso — 2-column grid
+    if calypso:
+        parts.append('<div style="margin-top:8px;font-size:1.05rem;color:#888;text-transform:uppercase;letter-spacing:0.08em;">🌴 Away with Calypso</div>')
+        parts.append('<div style="display:grid;grid-template-columns:1fr 1fr;gap:4px;margin-top:3px;">')
+        parts += [person_card("calypso", person) for person in calypso]
+        parts.append('</div>')
+    return "".join(parts)
+
+
+def panel(vc_id, vc_data):
+    """Panel HTML for a VC state, built once per version and shared by every session"""
+    cached = _panels.get(vc_id)
+    if cached is None or cached[0] != vc_data["seq"]:
+        with section("vc.up_next.build"):
+            cached = (vc_data["seq"], build_html(vc_data))
+        _panels[vc_id] = cached
+    return cached[1]